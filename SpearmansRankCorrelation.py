@@ -1,71 +1,51 @@
-import pandas as pd
-import numpy as np
-import os
-import scipy.stats as stats
-import matplotlib.pyplot as plt
+from plotting import FigureSpec, collect, emit, render_figures
+from prep import exit_on_load_error, prepare, regression_frames
 
 # Define the filename
 filename = '/Thesis files/CDR_data_Oct_17_2024.csv'
 
-# Read the CSV file into a pandas DataFrame
-try:
-    data = pd.read_csv(filename)
-    print("Data loaded successfully!")
-except FileNotFoundError:
-    print(f"Error: The file '{filename}' was not found.")
-    exit()
-except pd.errors.EmptyDataError:
-    print("Error: The file is empty.")
-    exit()
-except pd.errors.ParserError:
-    print("Error: There was an issue parsing the file.")
-    exit()
 
-# List of columns to include in the subset
-columns_to_keep = [
-    "purchaser_name", "supplier_name", "marketplace_name", "status", 
-    "method", "tons_purchased", "price_usd", "announcement_date", "delivery_date", "tons_delivered"
-]
+# Spearman's rank correlation between the USD price and the days since the first announcement; returns
+# the coefficient and its p-value
+def analyze(data_subset, data_subset_cleaned):
+    import scipy.stats as stats
 
-# Create the subset with the specified columns and filter for Biochar Carbon Removal (BCR)
-data_subset = data[columns_to_keep].copy()[data['method'] == 'Biochar Carbon Removal (BCR)']
+    # Round the USD price to two decimals and add the days since the first date
+    data_subset, data_subset_cleaned = regression_frames(data_subset, data_subset_cleaned)
 
-# Calculate price per ton
-data_subset['price_per_ton_USD'] = data_subset['price_usd'] / data_subset['tons_purchased']
-data_subset['price_per_ton_USD'] = data_subset['price_per_ton_USD'].round(2)
+    # Define variables for correlation analysis
+    X = data_subset_cleaned['days_since_start']  # Time as independent variable
+    y = data_subset_cleaned['price_per_ton_USD']  # Price per ton as dependent variable
 
-# Convert `announcement_date` to datetime and calculate days since first date
-data_subset['announcement_date'] = pd.to_datetime(data_subset['announcement_date'])
-data_subset['days_since_start'] = (data_subset['announcement_date'] - data_subset['announcement_date'].min()).dt.days
+    # Perform Spearman's Rank Correlation
+    spearman_corr, spearman_p_value = stats.spearmanr(X, y)
 
-# Drop NaN and infinite values
-data_subset_cleaned = data_subset.dropna(subset=['price_per_ton_USD'])
-data_subset_cleaned = data_subset_cleaned[~np.isinf(data_subset_cleaned['price_per_ton_USD'])]
+    # Print results
+    print(f"Spearman's Rank Correlation Coefficient: {spearman_corr:.3f}")
+    print(f"P-value: {spearman_p_value:.5f}")
 
-# Define variables for correlation analysis
-X = data_subset_cleaned['days_since_start']  # Time as independent variable
-y = data_subset_cleaned['price_per_ton_USD']  # Price per ton as dependent variable
+    # Interpretation
+    if spearman_p_value < 0.05:
+        print("The correlation is statistically significant (p < 0.05).")
+    else:
+        print("The correlation is not statistically significant (p >= 0.05).")
 
-# Perform Spearman's Rank Correlation
-spearman_corr, spearman_p_value = stats.spearmanr(X, y)
+    # Scatter plot with trendline
+    scatter_path = 'Thesis files/python_folder/spearman_price_vs_time.png'
+    emit(FigureSpec('scatter', scatter_path, {'x': X, 'y': y}, {
+        'label': 'Data Points',
+        'xlabel': "Days Since Start",
+        'ylabel': "Price per Ton (USD)",
+        'title': "Spearman's Rank Correlation: Price vs Time",
+    }))
+    print(f"Scatter plot saved to {scatter_path}")
 
-# Print results
-print(f"Spearman's Rank Correlation Coefficient: {spearman_corr:.3f}")
-print(f"P-value: {spearman_p_value:.5f}")
+    return spearman_corr, spearman_p_value
 
-# Interpretation
-if spearman_p_value < 0.05:
-    print("The correlation is statistically significant (p < 0.05).")
-else:
-    print("The correlation is not statistically significant (p >= 0.05).")
 
-# Scatter plot with trendline
-plt.scatter(X, y, alpha=0.6, label='Data Points')
-plt.xlabel("Days Since Start")
-plt.ylabel("Price per Ton (USD)")
-plt.title("Spearman's Rank Correlation: Price vs Time")
-plt.grid(True)
-
-# Display plot
-plt.legend()
-plt.show()
+if __name__ == '__main__':
+    with exit_on_load_error():
+        data_subset, data_subset_cleaned = prepare(filename)
+    with collect() as figures:
+        analyze(data_subset, data_subset_cleaned)
+    render_figures(figures)
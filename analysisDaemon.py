@@ -0,0 +1,262 @@
+import http.server
+import json
+import math
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from currency import FX_FILENAME
+from loader import BCR_METHOD, FILENAME, cache_dir
+from pipeline import ANALYSES, build_stages, execute_stage, execution_order, file_signature
+from plotting import render_figures, render_pool
+from sqlQuery import SQL_ENGINE, connect, frame_tables, query
+from stageCache import MEMO_DIRNAME, file_records, files_unchanged, stage_key
+
+# Only local clients: the daemon answers on the loopback interface
+HOST = '127.0.0.1'
+PORT = 8765
+
+# Seconds between two checks of the export and the FX table for changes
+POLL_SECONDS = 2.0
+
+# Stages kept resident: every analysis, and the cleaned transactions of all methods the SQL tables need
+TARGETS = ANALYSES + ['all_transactions_cleaned']
+
+# A resident stage result: its output, the digest of the output (what the keys of the stages downstream are
+# derived from), its key (None for the loaders), the printed report, the error if it failed, the seconds
+# it took and the records of the files it wrote (see stageCache.file_records; None when they are missing)
+Result = namedtuple('Result', ['output', 'digest', 'key', 'printed', 'error', 'seconds', 'files'])
+
+
+def _written(stage):
+    try:
+        return file_records(stage.outputs)
+    except OSError:
+        return None
+
+
+# Bring the resident results up to date. The loaders run again, and every other stage only when its key
+# changed (its code, its parameters or the digest of one of its inputs) or one of its declared outputs was
+# changed or deleted since it wrote it. A reloaded export whose BCR rows are unchanged therefore recomputes
+# nothing past the loaders, and new FX rates only what depends on EUR prices. A failure is kept like a
+# result: the stage is not retried until its key changes. Results missing from memory come from the memo
+# folder when it has them (a restarted daemon starts warm), through the same memo check as pipeline.py.
+# Returns ({stage: Result}, [names of the stages that ran]).
+def refresh(stages, results, targets=TARGETS, memo_dir=None, render=None):
+    fresh, ran = {}, []
+    for name in execution_order(stages, targets):
+        stage = stages[name]
+        failed = [i for i in stage.inputs if fresh[i].error is not None]
+        if failed:
+            fresh[name] = Result(None, None, None, '', f"skipped, input '{failed[0]}' failed", 0.0, {})
+            continue
+        key = stage_key(stage.function, stage.params, [fresh[i].digest for i in stage.inputs]) \
+            if stage.inputs else None
+        previous = results.get(name)
+        if key is not None and previous is not None and previous.key == key and \
+                (previous.error is not None or previous.files is not None and files_unchanged(previous.files)):
+            fresh[name] = previous
+            continue
+
+        started = time.perf_counter()
+        output, output_digest, printed, figures, error, _ = execute_stage(
+            stage, [fresh[i].output for i in stage.inputs], stage.params, memo_dir,
+            key if memo_dir is not None else None, keep_digest=True,
+        )
+        if render is not None and figures:
+            render(figures)
+        fresh[name] = Result(output, output_digest, key, printed, error, time.perf_counter() - started,
+                             _written(stage) if error is None else {})
+        ran.append(name)
+    return fresh, ran
+
+
+# A value as JSON data: frames and series as {index, columns, data} ('split' orientation, dates in ISO
+# format), tuples, lists and dicts item by item, NaN as null and anything else (model results) as text
+def jsonable(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return json.loads(value.to_json(orient='split', date_format='iso', default_handler=str))
+    if isinstance(value, (tuple, list)):
+        return [jsonable(item) for item in value]
+    if isinstance(value, dict):
+        return {str(name): jsonable(item) for name, item in value.items()}
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+# Check the watched files and refresh the resident results when they changed (or always, with force).
+# Requests keep being answered from the previous state until the new one replaces it in one assignment.
+# When a loader fails (e.g. the export is being replaced and briefly missing) the previous state is kept
+# and the files are checked again at the next poll.
+def reload(server, force=False):
+    with server.reload_lock:
+        signature = file_signature(server.files)
+        if not force and signature == server.state['signature']:
+            return False
+        started = time.perf_counter()
+        results, ran = refresh(
+            server.stages, server.state['results'], memo_dir=server.memo_dir,
+            render=lambda figures: render_figures(figures, pool=server.figure_pool),
+        )
+        failed = [name for name in results if not server.stages[name].inputs and results[name].error is not None]
+        if failed and server.state['version'] > 0:
+            print(f"Reload failed, still serving version {server.state['version']}: "
+                  f"{failed[0]}: {results[failed[0]].error}")
+            return False
+        connection = server.state['connection']
+        tables = ('all_transactions', 'all_transactions_cleaned')
+        if connection is None or any(name in ran for name in tables):
+            connection = None
+            if all(results[name].error is None for name in tables):
+                connection = connect(tables=frame_tables(*(results[name].output for name in tables)))
+        server.state = {
+            'version': server.state['version'] + 1,
+            'loaded_at': pd.Timestamp.now().isoformat(timespec='seconds'),
+            'signature': signature,
+            'results': results,
+            'connection': connection,
+            'bodies': {},
+        }
+        print(f"Version {server.state['version']}: {len(ran)} stages recomputed "
+              f"in {time.perf_counter() - started:.2f} s{': ' + ', '.join(ran) if ran else ''}")
+        return True
+
+
+def _watch(server, poll_seconds):
+    while True:
+        time.sleep(poll_seconds)
+        try:
+            reload(server)
+        except (Exception, SystemExit) as exc:
+            print(f"Reload failed: {type(exc).__name__}: {exc}")
+
+
+def _status(state):
+    return {
+        'version': state['version'],
+        'loaded_at': state['loaded_at'],
+        'sql_engine': SQL_ENGINE if state['connection'] is not None else None,
+        'analyses': {
+            name: {'seconds': round(state['results'][name].seconds, 3), 'error': state['results'][name].error}
+            for name in ANALYSES
+        },
+    }
+
+
+# Answer one request from the current state: (HTTP status, content type, body)
+#   GET /                        version, load time and per analysis the seconds it took and its error
+#   GET /analyses                names of the analyses
+#   GET /analyses/<name>         its result as JSON (see jsonable), encoded once per version
+#   GET /analyses/<name>/report  its printed report as text
+#   GET /sql?q=SELECT ...        a statement over the tables of sqlQuery.py
+#   GET /reload                  check the files for changes now
+def respond(server, path, parameters):
+    state = server.state
+    parts = [part for part in path.split('/') if part]
+    if not parts:
+        return 200, 'application/json', _status(state)
+    if parts == ['analyses']:
+        return 200, 'application/json', ANALYSES
+    if parts[0] == 'analyses' and len(parts) in (2, 3) and parts[1] in ANALYSES:
+        result = state['results'][parts[1]]
+        if len(parts) == 3:
+            if parts[2] != 'report':
+                return 404, 'application/json', {'error': f"Unknown path '{path}'"}
+            return 200, 'text/plain; charset=utf-8', result.printed
+        if result.error is not None:
+            return 500, 'application/json', {'name': parts[1], 'version': state['version'], 'error': result.error}
+        if parts[1] not in state['bodies']:
+            state['bodies'][parts[1]] = json.dumps(
+                {'name': parts[1], 'version': state['version'], 'result': jsonable(result.output)}
+            ).encode()
+        return 200, 'application/json', state['bodies'][parts[1]]
+    if parts == ['sql']:
+        if state['connection'] is None:
+            return 503, 'application/json', {'error': 'The SQL tables are not available'}
+        if 'q' not in parameters:
+            return 400, 'application/json', {'error': "Pass the statement as ?q="}
+        try:
+            with server.sql_lock:
+                frame = query(parameters['q'][0], state['connection'])
+        except Exception as exc:
+            return 400, 'application/json', {'error': f"{type(exc).__name__}: {exc}"}
+        return 200, 'application/json', jsonable(frame.set_index(pd.RangeIndex(len(frame))))
+    if parts == ['reload']:
+        reloaded = reload(server)
+        return 200, 'application/json', {'reloaded': reloaded, **_status(server.state)}
+    return 404, 'application/json', {'error': f"Unknown path '{path}'"}
+
+
+class AnalysisHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        try:
+            status, content_type, body = respond(self.server, url.path, urllib.parse.parse_qs(url.query))
+        except (Exception, SystemExit) as exc:
+            status, content_type, body = 500, 'application/json', {'error': f"{type(exc).__name__}: {exc}"}
+        if isinstance(body, str):
+            body = body.encode()
+        elif not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # The dashboard polls: no line per request
+    def log_message(self, format, *args):
+        pass
+
+
+# Load and prepare the export once, run every analysis and answer requests from the resident results
+# until interrupted. The export and the FX table are checked every poll_seconds; a change reloads them and
+# recomputes only the stages whose inputs changed (see refresh). With memo, results are also kept in the
+# export's memo folder, shared with pipeline.py.
+def serve(filename=FILENAME, method=BCR_METHOD, as_of=None, fx_filename=FX_FILENAME, host=HOST, port=PORT,
+          poll_seconds=POLL_SECONDS, memo=True, render_workers=None):
+    import matplotlib
+    matplotlib.use('Agg')
+
+    server = http.server.ThreadingHTTPServer((host, port), AnalysisHandler)
+    server.daemon_threads = True
+    server.stages = build_stages(filename, method, as_of, fx_filename)
+    server.files = [filename, fx_filename]
+    server.memo_dir = os.path.join(cache_dir(filename), MEMO_DIRNAME) if memo else None
+    server.reload_lock = threading.Lock()
+    server.sql_lock = threading.Lock()
+    server.state = {'version': 0, 'loaded_at': None, 'signature': None, 'results': {}, 'connection': None,
+                    'bodies': {}}
+    with render_pool(render_workers) as server.figure_pool:
+        reload(server, force=True)
+        threading.Thread(target=_watch, args=(server, poll_seconds), daemon=True).start()
+        print(f"Serving the analyses on http://{host}:{port}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == '__main__':
+    # Usage: python analysisDaemon.py [--port N] [--as-of YYYY-MM-DD|VERSION] [--poll SECONDS] [--no-memo]
+    # e.g. curl http://127.0.0.1:8765/analyses/stats
+    arguments = sys.argv[1:]
+    memo = '--no-memo' not in arguments
+    options = {'--port': PORT, '--as-of': None, '--poll': POLL_SECONDS}
+    for option in options:
+        if option in arguments:
+            options[option] = arguments[arguments.index(option) + 1]
+    serve(as_of=options['--as-of'], port=int(options['--port']), poll_seconds=float(options['--poll']), memo=memo)
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from currency import load_rates
+from loader import BCR_METHOD, CACHE_FORMAT, FILENAME, cache_dir, snapshot_hash
+from prep import exit_on_load_error, prepare
+from stageCache import digest
+
+# Dimensions of the cube, finest grain first to last; every roll-up groups by a subset of them
+DIMENSIONS = ['method', 'announcement_year', 'announcement_month', 'supplier_name', 'purchaser_name',
+              'marketplace_name']
+
+# Measures kept per cell. The sums and counts add up along any roll-up, min and max combine by min and max;
+# averages, standard deviations and weighted averages are derived from them after rolling up.
+SUM_MEASURES = ['transactions', 'priced_transactions', 'tons_purchased', 'price_usd', 'tons_priced',
+                'price_EUR_sum', 'price_EUR_squares', 'weighted_price_EUR_sum']
+MIN_MEASURES = ['min_price_EUR']
+MAX_MEASURES = ['max_price_EUR']
+
+# Folder (inside the export's cache folder) that holds the persisted cubes
+CUBE_DIRNAME = 'cube'
+
+# Bumped whenever the dimensions, the measures or the file layout change, so old cubes are rebuilt
+CUBE_VERSION = 1
+
+
+# Aggregate the transactions once per fine-grained cell (one row per combination of DIMENSIONS that occurs).
+# data_subset gives the transaction counts and tons, data_subset_cleaned the EUR prices of the priced rows;
+# rows with a missing dimension keep their own cell, so every roll-up still adds up to the full totals.
+def build_cube(data_subset, data_subset_cleaned):
+    frame = pd.DataFrame({
+        dimension: data_subset[dimension] for dimension in DIMENSIONS if dimension in data_subset
+    })
+    frame['announcement_month'] = data_subset['announcement_date'].dt.month
+    price = data_subset_cleaned['price_per_ton_EUR'].reindex(data_subset.index)
+    priced = price.notna()
+    frame['transactions'] = 1
+    frame['priced_transactions'] = priced.astype('int64')
+    frame['tons_purchased'] = data_subset['tons_purchased']
+    frame['price_usd'] = data_subset['price_usd']
+    frame['tons_priced'] = data_subset['tons_purchased'].where(priced)
+    frame['price_EUR_sum'] = price
+    frame['price_EUR_squares'] = price ** 2
+    frame['weighted_price_EUR_sum'] = price * data_subset['tons_purchased']
+    frame['min_price_EUR'] = price
+    frame['max_price_EUR'] = price
+
+    dimensions = [dimension for dimension in DIMENSIONS if dimension in frame]
+    grouped = frame.groupby(dimensions, observed=True, dropna=False, sort=False)
+    cube = pd.concat([
+        grouped[SUM_MEASURES].sum(min_count=0),
+        grouped[MIN_MEASURES].min(),
+        grouped[MAX_MEASURES].max(),
+    ], axis=1)
+    return cube.reset_index()
+
+
+# Keep the cells matching every filter: a dimension equal to a value, or in a list, tuple or set of values
+def slice_cube(cube, **where):
+    mask = np.ones(len(cube), dtype=bool)
+    for dimension, value in where.items():
+        column = cube[dimension]
+        mask &= column.isin(value).to_numpy() if isinstance(value, (list, tuple, set)) else (column == value).to_numpy()
+    return cube[mask]
+
+
+# Roll the cube up to the given dimensions (none: the grand total), optionally sliced first (see
+# slice_cube), and derive the per-group averages from the rolled-up measures:
+# - avg_price_EUR and std_price_EUR (sample, like pandas) of the price per ton
+# - weighted_avg_price_EUR: the price per ton weighted by tons purchased
+def rollup(cube, by=(), **where):
+    cells = slice_cube(cube, **where)
+    by = list(by)
+    if by:
+        grouped = cells.groupby(by, observed=True, sort=True)
+        result = pd.concat([
+            grouped[SUM_MEASURES].sum(),
+            grouped[MIN_MEASURES].min(),
+            grouped[MAX_MEASURES].max(),
+        ], axis=1)
+    else:
+        # Column by column, so the counts stay integers
+        result = pd.DataFrame({
+            **{measure: [cells[measure].sum()] for measure in SUM_MEASURES},
+            **{measure: [cells[measure].min()] for measure in MIN_MEASURES},
+            **{measure: [cells[measure].max()] for measure in MAX_MEASURES},
+        })
+    n = result['priced_transactions']
+    result['avg_price_EUR'] = result['price_EUR_sum'] / n.where(n > 0)
+    variance = (result['price_EUR_squares'] - n * result['avg_price_EUR'] ** 2) / (n - 1).where(n > 1)
+    result['std_price_EUR'] = np.sqrt(variance.clip(lower=0))
+    result['weighted_avg_price_EUR'] = result['weighted_price_EUR_sum'] / result['tons_priced'].where(n > 0)
+    return result
+
+
+def _cube_file(filename, method):
+    key = hashlib.sha256(repr((
+        CUBE_VERSION, snapshot_hash(filename), method, digest(load_rates()),
+    )).encode()).hexdigest()
+    return os.path.join(cache_dir(filename), CUBE_DIRNAME, f"{key}.{CACHE_FORMAT}")
+
+
+# The cube of one method of an export (every method with method=None), built on first use and then read
+# back from the cache folder. The file is keyed by the content hash of the export and by the FX table, so an
+# updated export or new rates build a fresh cube.
+def load_cube(filename=FILENAME, method=None):
+    path = _cube_file(filename, method)
+    if os.path.exists(path):
+        return pd.read_parquet(path) if CACHE_FORMAT == 'parquet' else pd.read_pickle(path)
+
+    data_subset, data_subset_cleaned = prepare(filename, method=method)
+    cube = build_cube(data_subset, data_subset_cleaned)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    if CACHE_FORMAT == 'parquet':
+        cube.to_parquet(temporary, index=False)
+    else:
+        cube.to_pickle(temporary)
+    os.replace(temporary, path)
+    return cube
+
+
+if __name__ == '__main__':
+    # Usage: python cube.py [--all-methods] [dimension ...]
+    # Prints the roll-up of the BCR (or every method's) cube to the given dimensions, e.g.
+    # "python cube.py announcement_year announcement_month marketplace_name"
+    method = None if '--all-methods' in sys.argv else BCR_METHOD
+    by = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    unknown = sorted(set(by) - set(DIMENSIONS))
+    if unknown:
+        print(f"Unknown dimensions: {', '.join(unknown)} (choose from {', '.join(DIMENSIONS)})")
+        sys.exit(1)
+
+    with exit_on_load_error():
+        cube = load_cube(method=method)
+    print(f"Cube of {len(cube)} cells")
+    print(rollup(cube, by)[['transactions', 'priced_transactions', 'tons_purchased', 'avg_price_EUR',
+                            'weighted_avg_price_EUR', 'min_price_EUR', 'max_price_EUR']].round(2))
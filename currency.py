@@ -0,0 +1,63 @@
+import os
+
+import pandas as pd
+
+from stageCache import digest
+
+# Local table of daily USD/EUR reference rates: one row per day with the date and the USD price of one
+# EUR (as the ECB quotes it), e.g. "2024-10-17,1.0866". Days without a quote take the last earlier one.
+FX_FILENAME = 'Thesis files/fx_rates_usd_eur.csv'
+FX_COLUMNS = ['date', 'usd_per_eur']
+
+# Rate used for every date when there is no table, the fixed rate all scripts converted with before
+DEFAULT_RATE = 1.0718
+
+# Tables read in this process by (path, modification time, size), and the rate of every date aligned so
+# far per table digest; both only grow within one run
+_tables = {}
+_aligned = {}
+
+
+# The rate table sorted by date, read once per version of the file. Without the file, a single row at the
+# earliest timestamp holds DEFAULT_RATE, so every date converts at the fixed rate.
+def load_rates(fx_filename=FX_FILENAME):
+    try:
+        stat = os.stat(fx_filename)
+    except FileNotFoundError:
+        return pd.DataFrame({'date': [pd.Timestamp.min], 'usd_per_eur': [DEFAULT_RATE]})
+    key = (os.path.abspath(fx_filename), stat.st_mtime_ns, stat.st_size)
+    if key not in _tables:
+        rates = pd.read_csv(fx_filename, usecols=FX_COLUMNS)
+        rates['date'] = pd.to_datetime(rates['date'], errors='coerce')
+        rates['usd_per_eur'] = pd.to_numeric(rates['usd_per_eur'], errors='coerce')
+        # Unparseable rows and holidays quoted as '-' are dropped; a day listed twice keeps its last rate
+        rates = rates.dropna().sort_values('date', kind='stable').drop_duplicates('date', keep='last')
+        _tables[key] = rates.reset_index(drop=True)
+    return _tables[key]
+
+
+# USD per EUR on each of the dates, aligned with them. The distinct dates not seen before are joined to the
+# table in one sorted as-of join (the last quote on or before the date; the first quote for dates before
+# the table starts) and kept, so converting frames that share dates only looks the rates up again. Rows
+# without a date take the latest quote.
+def eur_rates(dates, rates=None):
+    rates = load_rates() if rates is None else rates
+    key = digest(rates)
+    known = _aligned.get(key, pd.Series(dtype='float64', index=pd.DatetimeIndex([])))
+
+    new = pd.DatetimeIndex(dates.dropna().unique()).difference(known.index).sort_values()
+    if len(new):
+        joined = pd.merge_asof(
+            pd.DataFrame({'date': new.astype(rates['date'].dtype)}), rates, on='date', direction='backward',
+        )
+        joined = joined['usd_per_eur'].fillna(rates['usd_per_eur'].iloc[0])
+        known = pd.concat([known, pd.Series(joined.to_numpy(), index=new)]).sort_index()
+        _aligned[key] = known
+
+    aligned = known.reindex(dates.to_numpy()).fillna(rates['usd_per_eur'].iloc[-1])
+    return pd.Series(aligned.to_numpy(), index=dates.index, name='usd_per_eur')
+
+
+# Convert USD amounts to EUR at the rate of their dates
+def to_eur(usd, dates, rates=None):
+    return usd / eur_rates(dates, rates)
@@ -0,0 +1,173 @@
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from loader import CACHE_FORMAT, FILENAME, cache_lock, cached_path, decode_categories, load_dictionary
+
+# Entity columns with a persisted secondary index (dictionary code -> row offsets into the columnar cache)
+INDEX_COLUMNS = ["purchaser_name", "supplier_name", "marketplace_name", "method"]
+
+# Per process: the cache file of each export version, the loaded indexes, the code of every entity and, per
+# cache file, the first row of each Parquet row group (or the encoded frame of a pickled cache)
+_cache_paths = {}
+_indexes = {}
+_codes = {}
+_row_groups = {}
+_frames = {}
+
+
+# Folder next to the cache file holding its indexes, one pair of .npy arrays per column
+def index_dir(cache_path):
+    return f"{os.path.splitext(cache_path)[0]}.index"
+
+
+# CSR layout of one column: the row offsets grouped by code (ascending within a code) and, per code, where
+# its offsets start; the rows of code c are rows[starts[c]:starts[c + 1]]. Missing values are not indexed.
+def build_index(codes, n_codes):
+    codes = np.asarray(codes, dtype='int64')
+    valid = np.flatnonzero(codes >= 0)
+    rows = valid[np.argsort(codes[valid], kind='stable')]
+    starts = np.zeros(n_codes + 1, dtype='int64')
+    starts[1:] = np.cumsum(np.bincount(codes[valid], minlength=n_codes))
+    return rows, starts
+
+
+# Write the indexes of a cache file from the codes of its index columns ({column: codes in row order}).
+# Called while the cache file is ingested (loader._write_cache), before the file itself appears.
+def write_index(cache_path, codes_by_column, dictionary):
+    directory = index_dir(cache_path)
+    temporary = f"{directory}.{os.getpid()}.tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    for column, codes in codes_by_column.items():
+        rows, starts = build_index(codes, len(dictionary[column]))
+        np.save(os.path.join(temporary, f"{column}.rows.npy"), rows)
+        np.save(os.path.join(temporary, f"{column}.starts.npy"), starts)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temporary, directory)
+
+
+# Build the indexes of a cache file written before they existed, from its stored codes. The cache folder is
+# locked like for any other write to it; another process may have built them while we waited.
+def _rebuild_index(cache_path):
+    with cache_lock(os.path.dirname(cache_path)):
+        if os.path.isdir(index_dir(cache_path)):
+            return
+        if CACHE_FORMAT == 'parquet':
+            codes = pd.read_parquet(cache_path, columns=INDEX_COLUMNS)
+        else:
+            codes = pd.read_pickle(cache_path)[INDEX_COLUMNS]
+        write_index(cache_path, {column: codes[column].to_numpy() for column in INDEX_COLUMNS},
+                    load_dictionary(os.path.dirname(cache_path)))
+
+
+def _cache_path(filename):
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+    if key not in _cache_paths:
+        path = cached_path(filename)
+        if not os.path.isdir(index_dir(path)):
+            _rebuild_index(path)
+        _cache_paths[key] = path
+    return _cache_paths[key]
+
+
+# (rows, starts) of one column, memory-mapped: only the pages of the looked-up codes are read
+def _index(cache_path, column):
+    key = (cache_path, column)
+    if key not in _indexes:
+        directory = index_dir(cache_path)
+        _indexes[key] = (
+            np.load(os.path.join(directory, f"{column}.rows.npy"), mmap_mode='r'),
+            np.load(os.path.join(directory, f"{column}.starts.npy"), mmap_mode='r'),
+        )
+    return _indexes[key]
+
+
+def _code(cache_path, column, value):
+    key = (cache_path, column)
+    if key not in _codes:
+        _codes[key] = {name: code for code, name in enumerate(load_dictionary(os.path.dirname(cache_path))[column])}
+    return _codes[key].get(value)
+
+
+# Offsets (into the columnar cache, all methods) of the rows whose column equals value, in row order;
+# an entity never seen (or only added to the dictionary by a later export) has no rows
+def row_offsets(column, value, filename=FILENAME):
+    if column not in INDEX_COLUMNS:
+        raise ValueError(f"No index on '{column}' (indexed: {', '.join(INDEX_COLUMNS)})")
+    cache_path = _cache_path(filename)
+    code = _code(cache_path, column, value)
+    rows, starts = _index(cache_path, column)
+    if code is None or code + 1 >= len(starts):
+        return np.array([], dtype='int64')
+    return np.asarray(rows[starts[code]:starts[code + 1]])
+
+
+# Read the cached rows at the given offsets (ascending), indexed by their offsets. From Parquet only the row
+# groups holding an offset are read and the rows taken from them before decoding; a pickled cache has no
+# partial reads, so its encoded frame is loaded once per process and the rows taken from it.
+def read_rows(cache_path, offsets):
+    offsets = np.asarray(offsets, dtype='int64')
+    if CACHE_FORMAT == 'parquet':
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(cache_path)
+        if cache_path not in _row_groups:
+            sizes = [parquet_file.metadata.row_group(group).num_rows
+                     for group in range(parquet_file.metadata.num_row_groups)]
+            _row_groups[cache_path] = np.concatenate([[0], np.cumsum(sizes, dtype='int64')])
+        firsts = _row_groups[cache_path]
+        group_of = np.searchsorted(firsts, offsets, side='right') - 1
+        groups = np.unique(group_of)
+        # Where each group read starts in the table of the groups read, and so where every offset lands in it
+        read_firsts = np.concatenate([[0], np.cumsum(np.diff(firsts)[groups])])
+        positions = offsets - firsts[group_of] + read_firsts[np.searchsorted(groups, group_of)]
+        frame = parquet_file.read_row_groups(groups.tolist()).take(positions).to_pandas()
+    else:
+        if cache_path not in _frames:
+            _frames[cache_path] = pd.read_pickle(cache_path)
+        frame = _frames[cache_path].take(offsets).reset_index(drop=True)
+    frame.index = pd.Index(offsets)
+    return decode_categories(frame, load_dictionary(os.path.dirname(cache_path)))
+
+
+# The transactions matching every condition (column=value, each an indexed column), e.g.
+# lookup(marketplace_name='Puro', method=BCR_METHOD). The offsets of the conditions are intersected and
+# only those rows are read from the cache (see read_rows).
+def lookup(filename=FILENAME, **where):
+    if not where:
+        raise ValueError("lookup needs at least one condition")
+    offsets = None
+    for column, value in where.items():
+        rows = row_offsets(column, value, filename)
+        offsets = rows if offsets is None else np.intersect1d(offsets, rows, assume_unique=True)
+    return read_rows(_cache_path(filename), offsets)
+
+
+if __name__ == '__main__':
+    # Usage: python entityIndex.py column=value [column=value ...] [--min-eur PRICE]
+    # e.g. python entityIndex.py marketplace_name=Puro --min-eur 200
+    from prep import clean_prices, derive_prices
+
+    arguments = sys.argv[1:]
+    min_eur = None
+    if '--min-eur' in arguments:
+        position = arguments.index('--min-eur')
+        min_eur = float(arguments[position + 1])
+        del arguments[position:position + 2]
+    where = dict(argument.split('=', 1) for argument in arguments)
+
+    lookup(**where)  # first call loads the index
+    started = time.perf_counter()
+    matches = lookup(**where)
+    print(f"{len(matches)} transactions in {(time.perf_counter() - started) * 1000:.3f} ms")
+    if min_eur is not None:
+        # Prices are derived for the matching rows only
+        matches = clean_prices(derive_prices(matches.copy()))
+        matches = matches[matches['price_per_ton_EUR'] > min_eur]
+        print(f"{len(matches)} of them above {min_eur:g} EUR/ton")
+    print(matches)
@@ -0,0 +1,138 @@
+import datetime
+import importlib.util
+import os
+import sys
+import time
+
+import pandas as pd
+
+# xlsxwriter in constant_memory mode streams every finished row to a temporary file, so memory stays flat
+# however long a sheet is; openpyxl's write-only workbook is the fallback when xlsxwriter is not installed.
+# Both take the rows one after the other, which is the order the sheets are written in here.
+EXCEL_ENGINE = 'xlsxwriter' if importlib.util.find_spec('xlsxwriter') else 'openpyxl'
+
+# Formats the raw-data sheets can also be written in on request (side_formats of write_workbook), as files
+# next to the workbook that load far faster than the sheet; Parquet needs pyarrow, CSV always works
+SIDE_FORMATS = ('parquet',) if importlib.util.find_spec('pyarrow') else ('csv',)
+
+# Rows converted to cell values at a time
+CHUNK_ROWS = 10000
+
+# Format of the date cells, as pandas writes them
+DATETIME_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+
+
+# The cells of one column as Python values: missing values become None (an empty cell), timestamps
+# datetimes, and anything else that is not a number, text or bool its text
+def _cells(values):
+    values = pd.Series(values, copy=False)
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        values = values.dt.tz_localize(None)
+    cells = values.astype(object).where(values.notna(), None).tolist()
+    if values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype):
+        cells = [cell if cell is None or isinstance(cell, (str, int, float, bool, datetime.datetime)) else str(cell)
+                 for cell in cells]
+    return cells
+
+
+# Header and rows of a sheet; with index, the index levels come first, headed by their names. The rows are
+# converted CHUNK_ROWS at a time, so only one block of them exists as Python values at any point.
+def _rows(frame, index):
+    header = list(frame.index.names) if index else []
+    header = ['' if name is None else name for name in header] + [
+        ' '.join(map(str, name)) if isinstance(name, tuple) else name for name in frame.columns
+    ]
+
+    def rows():
+        for start in range(0, len(frame), CHUNK_ROWS):
+            block = frame.iloc[start:start + CHUNK_ROWS]
+            columns = [_cells(block.index.get_level_values(level)) for level in range(block.index.nlevels)] \
+                if index else []
+            columns += [_cells(block.iloc[:, position]) for position in range(block.shape[1])]
+            yield from zip(*columns)
+
+    return _cells(header), rows()
+
+
+def _write_xlsxwriter(path, sheets, index):
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(path, {
+        'constant_memory': True, 'nan_inf_to_errors': True, 'remove_timezone': True,
+        'strings_to_formulas': False, 'strings_to_urls': False, 'default_date_format': DATETIME_FORMAT,
+    })
+    bold = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+    for name, frame in sheets.items():
+        worksheet = workbook.add_worksheet(name)
+        header, rows = _rows(frame, name in index)
+        worksheet.write_row(0, 0, header, bold)
+        for number, row in enumerate(rows, 1):
+            worksheet.write_row(number, 0, row)
+    workbook.close()
+
+
+def _write_openpyxl(path, sheets, index):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    workbook = Workbook(write_only=True)
+    for name, frame in sheets.items():
+        worksheet = workbook.create_sheet(name)
+        header, rows = _rows(frame, name in index)
+        cells = []
+        for value in header:
+            cell = WriteOnlyCell(worksheet, value)
+            cell.font = Font(bold=True)
+            cells.append(cell)
+        worksheet.append(cells)
+        for row in rows:
+            worksheet.append(row)
+    workbook.save(path)
+
+
+# Side file of a raw-data sheet: '<workbook>.<sheet>.<format>', spaces in the sheet name as underscores
+def side_path(path, sheet, side_format):
+    return f"{os.path.splitext(path)[0]}.{sheet.replace(' ', '_')}.{side_format}"
+
+
+# Write the sheets ({sheet name: frame}, in order) as one workbook, streamed row by row (see EXCEL_ENGINE).
+# The sheets named in index are written with their index in front, the others without. The sheets named in
+# raw are the raw-data ones: each is also written in every format of side_formats (see side_path), none
+# by default (pass SIDE_FORMATS for them). The workbook appears under its name only once complete.
+# Returns the paths written.
+def write_workbook(path, sheets, index=(), raw=(), side_formats=(), engine=EXCEL_ENGINE):
+    temporary = f"{path}.{os.getpid()}.tmp"
+    if engine == 'xlsxwriter':
+        _write_xlsxwriter(temporary, sheets, index)
+    else:
+        _write_openpyxl(temporary, sheets, index)
+    os.replace(temporary, path)
+
+    paths = [path]
+    for sheet in raw:
+        for side_format in side_formats:
+            side = side_path(path, sheet, side_format)
+            if side_format == 'parquet':
+                sheets[sheet].to_parquet(side, index=sheet in index)
+            else:
+                sheets[sheet].to_csv(side, index=sheet in index)
+            paths.append(side)
+    return paths
+
+
+if __name__ == '__main__':
+    # Usage: python excelExport.py [ROWS] [--side-outputs]
+    # Times the export of ROWS (default 100,000) prepared transactions with the streaming writer; with
+    # --side-outputs the rows are also written in the SIDE_FORMATS
+    from prep import exit_on_load_error, prepare
+
+    arguments = [argument for argument in sys.argv[1:] if argument != '--side-outputs']
+    side_formats = SIDE_FORMATS if '--side-outputs' in sys.argv else ()
+    rows = int(arguments[0]) if arguments else 100_000
+    with exit_on_load_error():
+        _, data_subset_cleaned = prepare()
+    frame = data_subset_cleaned.sample(rows, replace=True, random_state=0).reset_index(drop=True)
+    started = time.perf_counter()
+    paths = write_workbook('excel_export_benchmark.xlsx', {'Data Subset': frame}, raw=['Data Subset'],
+                           side_formats=side_formats)
+    print(f"{rows} rows written with {EXCEL_ENGINE} in {time.perf_counter() - started:.2f} s: {', '.join(paths)}")
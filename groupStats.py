@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+# Statistics the engine can compute, in the order of the result columns
+STATISTICS = ['count', 'sum', 'min', 'max', 'mean', 'median', 'mode', 'std']
+
+
+# Compute per-group statistics of one value column in a single pass over a sort, without Python-level
+# callbacks per group. Rows are sorted by (group, value) once; then min/max are the group edges, the median
+# the middle of each group, and the mode the longest run of equal values (ties go to the smallest value,
+# like x.mode()[0]). Missing values are ignored like pandas does; missing keys are dropped like groupby.
+# Returns a DataFrame indexed by the group key(s) with one column per requested statistic.
+def grouped_stats(frame, keys, value, statistics=('count', 'min', 'max', 'mean', 'median', 'mode', 'std')):
+    unknown = set(statistics) - set(STATISTICS)
+    if unknown:
+        raise ValueError(f"Unknown statistics: {sorted(unknown)}")
+
+    grouped = frame.groupby(keys, sort=True, observed=True)
+    index = grouped.size().index
+    codes = grouped.ngroup().fillna(-1).to_numpy(dtype='int64')
+    values = frame[value].to_numpy(dtype='float64')
+
+    # Keep rows with a key and a value, then sort by group code and value within each group
+    valid = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+    order = np.lexsort((values, codes))
+    codes, values = codes[order], values[order]
+
+    # Group boundaries in the sorted arrays; groups whose values are all missing get count 0
+    present, starts, counts = np.unique(codes, return_index=True, return_counts=True)
+    ends = starts + counts - 1
+    n_groups = len(index)
+
+    def scatter(result, fill=np.nan):
+        full = np.full(n_groups, fill, dtype='float64')
+        full[present] = result
+        return full
+
+    columns = {}
+    sums = np.add.reduceat(values, starts) if len(values) else np.array([])
+    means = sums / counts if len(values) else np.array([])
+    if 'count' in statistics:
+        columns['count'] = scatter(counts, fill=0).astype('int64')
+    if 'sum' in statistics:
+        columns['sum'] = scatter(sums, fill=0.0)
+    if 'min' in statistics:
+        columns['min'] = scatter(values[starts])
+    if 'max' in statistics:
+        columns['max'] = scatter(values[ends])
+    if 'mean' in statistics:
+        columns['mean'] = scatter(means)
+    if 'median' in statistics:
+        lower = values[starts + (counts - 1) // 2]
+        upper = values[starts + counts // 2]
+        columns['median'] = scatter((lower + upper) / 2)
+    if 'mode' in statistics:
+        columns['mode'] = scatter(_run_length_mode(codes, values))
+    if 'std' in statistics:
+        # Sample standard deviation (ddof=1) from the squared deviations to the group mean
+        squared = (values - np.repeat(means, counts)) ** 2
+        deviations = np.add.reduceat(squared, starts) if len(values) else np.array([])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.where(counts > 1, np.sqrt(deviations / (counts - 1)), np.nan)
+        columns['std'] = scatter(std)
+
+    return pd.DataFrame({name: columns[name] for name in statistics}, index=index)
+
+
+# Mode per group by run-length encoding of the sorted (group, value) pairs
+def _run_length_mode(codes, values):
+    if not len(values):
+        return np.array([])
+    is_run_start = np.ones(len(values), dtype=bool)
+    is_run_start[1:] = (codes[1:] != codes[:-1]) | (values[1:] != values[:-1])
+    run_starts = np.flatnonzero(is_run_start)
+    run_lengths = np.diff(np.append(run_starts, len(values)))
+    run_codes = codes[run_starts]
+
+    # Longest run per group, then the first (smallest value) run of that length
+    group_run_starts = np.flatnonzero(np.r_[True, run_codes[1:] != run_codes[:-1]])
+    longest = np.maximum.reduceat(run_lengths, group_run_starts)
+    is_longest = run_lengths == np.repeat(longest, np.diff(np.append(group_run_starts, len(run_codes))))
+    _, first = np.unique(run_codes[is_longest], return_index=True)
+    return values[run_starts[np.flatnonzero(is_longest)[first]]]
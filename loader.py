@@ -0,0 +1,311 @@
+import contextlib
+import hashlib
+import importlib.util
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Define the default filename of the CDR export
+FILENAME = 'Thesis files/CDR_data_Oct_17_2024.csv'
+
+# Columns every analysis works on, and the parse type of each one
+COLUMNS_TO_KEEP = [
+    "purchaser_name", "supplier_name", "marketplace_name", "status",
+    "method", "tons_purchased", "price_usd", "announcement_date", "delivery_date", "tons_delivered"
+]
+DTYPES = {
+    "purchaser_name": str, "supplier_name": str, "marketplace_name": str, "status": str,
+    "method": str, "tons_purchased": "float64", "price_usd": "float64",
+    "announcement_date": str, "delivery_date": str, "tons_delivered": "float64"
+}
+
+# Entity columns stored as integer codes into a persisted dictionary and loaded as categoricals
+CATEGORY_COLUMNS = ["purchaser_name", "supplier_name", "marketplace_name", "status", "method"]
+
+# The method every thesis script filters on
+BCR_METHOD = 'Biochar Carbon Removal (BCR)'
+
+# Rows parsed per chunk when streaming the CSV
+CHUNKSIZE = 100_000
+
+# Folder (created next to the CSV) that holds the columnar copies of the kept columns of each export
+CACHE_DIRNAME = '.cdr_cache'
+MANIFEST_NAME = 'manifest.json'
+DICTIONARY_NAME = 'dictionary.json'
+LOCK_NAME = '.lock'
+
+# Bumped whenever the layout of the cached files changes, so stale copies are rebuilt
+CACHE_VERSION = 2
+
+# Parquet needs pyarrow; without it the cache falls back to pickled frames. Only look it up here: pyarrow
+# itself is imported by the functions that read or write Parquet
+CACHE_FORMAT = 'parquet' if importlib.util.find_spec('pyarrow') else 'pickle'
+
+
+def cache_dir(filename=FILENAME):
+    return os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIRNAME)
+
+
+# Hash the raw bytes of the export in blocks so large files are never held in memory
+def file_hash(filename, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as handle:
+            return json.load(handle)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_json(path, content):
+    # Write to a temporary file of its own first so a crash never leaves a half-written file and two
+    # writers never share one
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path),
+                                             suffix='.tmp')
+    with os.fdopen(descriptor, 'w') as handle:
+        json.dump(content, handle, indent=2)
+    os.replace(temporary, path)
+
+
+def _write_manifest(directory, manifest):
+    _write_json(os.path.join(directory, MANIFEST_NAME), manifest)
+
+
+# Exclusive lock on a cache folder, held while the dictionary is read, extended and saved and a cache file
+# written, so processes building caches at the same time (parallel loader stages, the daemon next to the
+# pipeline) never interleave them. Not reentrant: take it once per operation.
+@contextlib.contextmanager
+def cache_lock(directory):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_NAME), 'a+b') as handle:
+        if os.name == 'nt':
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+# The dictionary maps every entity column to its values in order of first appearance. It is shared by
+# all exports in the cache folder and only ever appended to, so a value keeps its code across runs.
+def load_dictionary(directory):
+    try:
+        with open(os.path.join(directory, DICTIONARY_NAME)) as handle:
+            dictionary = json.load(handle)
+    except (FileNotFoundError, json.JSONDecodeError):
+        dictionary = {}
+    return {column: dictionary.get(column, []) for column in CATEGORY_COLUMNS}
+
+
+def save_dictionary(directory, dictionary):
+    _write_json(os.path.join(directory, DICTIONARY_NAME), dictionary)
+
+
+# Replace the entity columns of a chunk by their int32 codes, appending unseen values to the dictionary
+def encode_categories(chunk, dictionary):
+    chunk = chunk.copy()
+    for column in CATEGORY_COLUMNS:
+        if column not in chunk:
+            continue
+        categories = dictionary[column]
+        values = chunk[column]
+        unseen = pd.unique(values[values.notna() & ~values.isin(categories)])
+        categories.extend(str(value) for value in unseen)
+        chunk[column] = pd.Categorical(values, categories=categories).codes.astype('int32')
+    return chunk
+
+
+# Turn stored codes back into categoricals. The categories are handed out in sorted order (a permutation
+# of the stored codes, no string hashing), so groupbys on them keep the alphabetical order of plain strings.
+def decode_categories(frame, dictionary):
+    for column in CATEGORY_COLUMNS:
+        if column not in frame:
+            continue
+        categories = pd.Index(dictionary[column], dtype=object)
+        order = categories.argsort()
+        remap = np.empty(len(order) + 1, dtype='int32')
+        remap[order] = np.arange(len(order), dtype='int32')
+        remap[-1] = -1  # missing values stay missing
+        codes = frame[column].to_numpy(dtype='int32')
+        frame[column] = pd.Categorical.from_codes(remap[codes], categories=categories[order])
+    return frame
+
+
+def _cache_file(directory, sha256):
+    return os.path.join(directory, f'{sha256}.v{CACHE_VERSION}.{CACHE_FORMAT}')
+
+
+def _arrow_type(column):
+    import pyarrow as pa
+    if column in CATEGORY_COLUMNS:
+        return pa.int32()
+    return pa.float64() if DTYPES[column] == 'float64' else pa.string()
+
+
+# Build the columnar copy by streaming the CSV, so the export is never parsed in one piece.
+# Every chunk is written with the same explicit schema, whatever types pandas would infer for it,
+# and the entity columns are stored as codes into the persisted dictionary. The secondary indexes of
+# the entity columns (entityIndex.py) are built from the same codes on the way.
+# Called with the cache folder locked (see cache_lock).
+def _write_cache(filename, path):
+    # Imported here: the index module reads the cache through this one
+    from entityIndex import INDEX_COLUMNS, write_index
+
+    directory = os.path.dirname(path)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    dictionary = load_dictionary(directory)
+    codes = {column: [] for column in INDEX_COLUMNS}
+
+    def encoded_chunks():
+        for chunk in iter_transactions(filename, method=None, columns=COLUMNS_TO_KEEP):
+            chunk = encode_categories(chunk, dictionary)
+            for column in INDEX_COLUMNS:
+                codes[column].append(chunk[column].to_numpy())
+            yield chunk
+
+    chunks = encoded_chunks()
+    if CACHE_FORMAT == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = pa.schema([(column, _arrow_type(column)) for column in COLUMNS_TO_KEEP])
+        with pq.ParquetWriter(temporary, schema) as writer:
+            for chunk in chunks:
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    else:
+        empty = pd.DataFrame(columns=COLUMNS_TO_KEEP).astype(DTYPES).pipe(encode_categories, dictionary)
+        frame = pd.concat([empty, *chunks], ignore_index=True)
+        frame.to_pickle(temporary)
+    # The dictionary and the indexes are saved before the cache file appears, so no cached code is ever
+    # unknown and a cache file always has its indexes
+    save_dictionary(directory, dictionary)
+    write_index(path, {column: np.concatenate(parts) if parts else np.array([], dtype='int32')
+                       for column, parts in codes.items()}, dictionary)
+    os.replace(temporary, path)
+
+
+def _read_cache(path, columns=None, method=None):
+    dictionary = load_dictionary(os.path.dirname(path))
+    # The method filter is pushed down on its code; a method never seen matches no row
+    code = None
+    if method is not None:
+        code = dictionary['method'].index(method) if method in dictionary['method'] else -2
+
+    if CACHE_FORMAT == 'parquet':
+        filters = None if code is None else [('method', '==', code)]
+        usecols = columns if columns is None or code is None or 'method' in columns else columns + ['method']
+        frame = pd.read_parquet(path, columns=usecols, filters=filters)
+    else:
+        frame = pd.read_pickle(path)
+        if code is not None:
+            frame = frame[frame['method'] == code]
+    frame = (frame if columns is None else frame[columns]).reset_index(drop=True)
+    return decode_categories(frame, dictionary)
+
+
+# Return the path of the columnar copy if it is still valid for the export, None otherwise
+def warm_cache_path(filename=FILENAME):
+    stat = os.stat(filename)
+    directory = cache_dir(filename)
+    entry = _read_manifest(directory).get(os.path.abspath(filename))
+    if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+        path = _cache_file(directory, entry['sha256'])
+        if os.path.exists(path):
+            return path
+    return None
+
+
+# Return the path of the columnar copy of the export, parsing the CSV only on a cache miss
+def cached_path(filename=FILENAME):
+    path = warm_cache_path(filename)
+    if path is not None:
+        return path
+
+    # The file was touched or is new: hash the content, an identical copy may already be cached. Another
+    # process may be building the same copy: once the lock is ours it is either there or ours to write.
+    stat = os.stat(filename)
+    directory = cache_dir(filename)
+    key = os.path.abspath(filename)
+    sha256 = file_hash(filename)
+    path = _cache_file(directory, sha256)
+    with cache_lock(directory):
+        if not os.path.exists(path):
+            _write_cache(filename, path)
+        manifest = _read_manifest(directory)
+        manifest[key] = {'sha256': sha256, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+        _write_manifest(directory, manifest)
+    return path
+
+
+# Content hash of the export, taken from the manifest so warm calls do not re-hash the file
+def snapshot_hash(filename=FILENAME):
+    cached_path(filename)
+    return _read_manifest(cache_dir(filename))[os.path.abspath(filename)]['sha256']
+
+
+# Load the kept columns of every transaction in the export, served from the columnar cache
+def load_data(filename=FILENAME, columns=None):
+    return _read_cache(cached_path(filename), columns=columns)
+
+
+# Stream the export in chunks, reading only the requested columns and keeping only rows of one method
+def iter_transactions(filename=FILENAME, method=BCR_METHOD, columns=None, chunksize=CHUNKSIZE):
+    columns = list(COLUMNS_TO_KEEP if columns is None else columns)
+    usecols = columns if method is None or 'method' in columns else columns + ['method']
+    dtypes = {column: DTYPES[column] for column in usecols if column in DTYPES}
+
+    for chunk in pd.read_csv(filename, usecols=usecols, dtype=dtypes, chunksize=chunksize):
+        if method is not None:
+            chunk = chunk[chunk['method'] == method]
+        yield chunk[columns]
+
+
+# Load the transactions of one method (all methods with method=None) restricted to the given columns.
+# The columnar cache is read with the projection and the method filter pushed into the reader; columns
+# outside the cache are streamed from the CSV chunk by chunk. Either way the full-width frame of all
+# methods is never built.
+def load_transactions(filename=FILENAME, method=BCR_METHOD, columns=None, chunksize=CHUNKSIZE):
+    columns = list(COLUMNS_TO_KEEP if columns is None else columns)
+    if set(columns) <= set(COLUMNS_TO_KEEP):
+        return _read_cache(cached_path(filename), columns=columns, method=method)
+
+    chunks = list(iter_transactions(filename, method=method, columns=columns, chunksize=chunksize))
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    frame = pd.concat(chunks, ignore_index=True)
+    for column in CATEGORY_COLUMNS:
+        if column in frame:
+            frame[column] = frame[column].astype('category')
+    return frame
+
+
+# Count all rows of the export (every method) without loading any of its columns; with as_of, the rows of
+# the snapshot ingested for that date (or version) instead, from the store's row keys (see store.py)
+def count_transactions(filename=FILENAME, as_of=None):
+    if as_of is not None:
+        # Imported here: the store builds on this module
+        from store import resolve_version, rows_at, store_dir
+        directory = store_dir(filename)
+        return len(rows_at(directory, resolve_version(directory, as_of)))
+    path = cached_path(filename)
+    if CACHE_FORMAT == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    return len(pd.read_pickle(path))
@@ -0,0 +1,130 @@
+import sys
+
+import pandas as pd
+
+from excelExport import write_workbook
+from groupStats import grouped_stats
+from prep import exit_on_load_error, prepare
+
+# Define the filename
+filename = 'Thesis files/CDR_data_Oct_17_2024.csv'
+
+# Workbook the per-method tables are exported to, one sheet per table
+OUTPUT_FILENAME = 'cdr_all_methods_analysis.xlsx'
+
+# Statistics of the yearly and total price tables, as named in stats.py
+PRICE_STATISTICS = {
+    'min': 'min_price_EUR',
+    'max': 'max_price_EUR',
+    'mean': 'avg_price_EUR',
+    'median': 'median_price_EUR',
+    'mode': 'mode_price_EUR',
+    'count': 'count',
+}
+
+
+# Price statistics per method and year plus per method over all years (the tables of stats.py, with
+# method as an extra group key), each with the number of transactions before dropping missing prices
+def price_stats(all_transactions, all_transactions_cleaned):
+    tables = []
+    for keys in (['method', 'announcement_year'], ['method']):
+        table = grouped_stats(
+            all_transactions_cleaned, keys, 'price_per_ton_EUR', list(PRICE_STATISTICS)
+        ).rename(columns=PRICE_STATISTICS)
+        table['total_entries'] = all_transactions.groupby(keys, observed=True).size()
+        tables.append(table.reset_index())
+    return tables
+
+
+# Tons purchased per method and year plus per method over all years (the table of volume.py)
+def volume_stats(all_transactions):
+    purchased = all_transactions.dropna(subset=['tons_purchased'])
+    tables = []
+    for keys in (['method', 'announcement_year'], ['method']):
+        tables.append(grouped_stats(
+            purchased, keys, 'tons_purchased', ['sum', 'mean', 'median', 'min', 'max', 'count']
+        ).rename(columns={
+            'sum': 'Total Tons Purchased',
+            'mean': 'Average Tons Purchased',
+            'median': 'Median Tons Purchased',
+            'min': 'Min Tons Purchased',
+            'max': 'Max Tons Purchased',
+            'count': 'Transaction Count',
+        }).reset_index())
+    return tables
+
+
+# Average price, transaction count and price variability per method and entity (the supplier.py and
+# buyers.py aggregates), with the entities of high variability (above the 75th percentile of their method)
+def entity_stats(all_transactions_cleaned, entity):
+    table = grouped_stats(
+        all_transactions_cleaned, ['method', entity], 'price_per_ton_EUR', ['mean', 'count', 'std']
+    ).rename(columns={'mean': 'avg_price_EUR', 'std': 'std_price_EUR'})
+    threshold = table.groupby(level='method', observed=True)['std_price_EUR'].transform('quantile', 0.75)
+    table['high_variability'] = table['std_price_EUR'] > threshold
+    return table.reset_index()
+
+
+# IQR outlier scan of marketplace.py, with the quartiles and bounds taken per method. Returns the bounds
+# and outlier count per method, and the outlying transactions.
+def outlier_scan(all_transactions_cleaned):
+    prices = all_transactions_cleaned['price_per_ton_EUR']
+    grouped = prices.groupby(all_transactions_cleaned['method'], observed=True)
+    bounds = pd.DataFrame({'Q1': grouped.quantile(0.25), 'Q3': grouped.quantile(0.75)})
+    bounds['IQR'] = bounds['Q3'] - bounds['Q1']
+    bounds['lower_bound'] = bounds['Q1'] - 1.5 * bounds['IQR']
+    bounds['upper_bound'] = bounds['Q3'] + 1.5 * bounds['IQR']
+
+    # Look every row's bounds up by its method instead of filtering the frame once per method
+    methods = all_transactions_cleaned['method'].astype(object)
+    lower = methods.map(bounds['lower_bound']).astype('float64')
+    upper = methods.map(bounds['upper_bound']).astype('float64')
+    outliers = all_transactions_cleaned[(prices < lower) | (prices > upper)]
+    outliers = outliers[['method', 'announcement_date', 'price_per_ton_EUR', 'marketplace_name',
+                         'supplier_name', 'purchaser_name']]
+
+    bounds['outlier_count'] = outliers.groupby('method', observed=True).size()
+    bounds['outlier_count'] = bounds['outlier_count'].fillna(0).astype('int64')
+    return bounds.reset_index(), outliers
+
+
+# Every method at once: yearly and total price statistics, volume summaries, supplier and buyer aggregates
+# and the outlier scan, each computed in one grouped pass with method as the leading key. Rows without a
+# method are left out, like groupby does. Returns the exported tables by sheet name.
+def analyze(all_transactions, all_transactions_cleaned):
+    stats, stats_total = price_stats(all_transactions, all_transactions_cleaned)
+    volume, volume_total = volume_stats(all_transactions)
+    bounds, outliers = outlier_scan(all_transactions_cleaned)
+    tables = {
+        'Statistics per year': stats,
+        'Stats total': stats_total,
+        'Volume per year': volume,
+        'Volume total': volume_total,
+        'Suppliers': entity_stats(all_transactions_cleaned, 'supplier_name'),
+        'Buyers': entity_stats(all_transactions_cleaned, 'purchaser_name'),
+        'Outlier bounds': bounds,
+        'Outliers': outliers,
+    }
+
+    # Print the overview tables
+    print("Price statistics per method (EUR/ton):")
+    print(stats_total.round(1))
+    print("\nTons purchased per method:")
+    print(volume_total.round(2))
+    print("\nOutliers in 'price_per_ton_EUR' per method:")
+    print(bounds.round(1))
+
+    write_workbook(OUTPUT_FILENAME, tables)
+
+    print(f"Statistics of all methods have been successfully exported to '{OUTPUT_FILENAME}'.")
+
+    return tables
+
+
+if __name__ == '__main__':
+    # Run with --as-of YYYY-MM-DD to reproduce the numbers of the snapshot ingested (store.py) for that date
+    as_of = sys.argv[sys.argv.index('--as-of') + 1] if '--as-of' in sys.argv else None
+
+    with exit_on_load_error():
+        all_transactions, all_transactions_cleaned = prepare(filename, method=None, as_of=as_of)
+    analyze(all_transactions, all_transactions_cleaned)
@@ -0,0 +1,509 @@
+import contextlib
+import glob
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+# The analysis modules import their plotting and modelling libraries inside analyze(), so importing
+# them all here only costs pandas; each library is loaded when the first stage needing it runs
+import buyerCorrelation
+import buyers
+import cube
+import distribution
+import duplicates
+import linearRegression
+import marketplace
+import methodStats
+import predicition
+import prepForRegression
+import report
+import seasonality
+import SpearmansRankCorrelation
+import stats
+import supplier
+import volume
+import weightedMeanLinearRegression
+from currency import FX_FILENAME, load_rates
+from loader import BCR_METHOD, FILENAME, cache_dir, count_transactions
+from plotting import FORMATS, collect, evict_figures, render_figure, render_pool
+from prep import clean_prices, load_prepared, load_subset, prepare_loaded
+from stageCache import MAX_CACHE_BYTES, MEMO_DIRNAME, digest, evict, forget, lookup, stage_key, store
+
+# Frames passed between processes are written once as memory-mapped Arrow IPC files, so every worker
+# maps the same pages instead of unpickling its own copy; without pyarrow they fall back to pickle files.
+# Frames with object columns (or an object index) are always pickled: Arrow infers a type for their values
+# and would not give them back as written.
+SHARED_FORMAT = 'arrow' if importlib.util.find_spec('pyarrow') else 'pickle'
+
+
+# Shared frames go to RAM-backed /dev/shm where it exists, otherwise to the default temporary folder
+SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Seconds between two checks of the watched files in watch mode
+WATCH_SECONDS = 1.0
+
+# A stage that took less than this on its last run stays in the parent process of a parallel run: starting
+# it on a worker (which imports its libraries again) and handing its frames over costs more than it saves
+PARALLEL_MIN_SECONDS = 0.5
+
+# File (in the export's cache folder) with the seconds each stage took when it last ran
+STAGE_SECONDS_NAME = 'stage_seconds.json'
+
+# A stage of the analysis DAG: the function to run, the names of the stages whose outputs it takes
+# (in argument order), its keyword parameters and the files it writes besides its figures (a memoized run
+# only counts while they exist)
+Stage = namedtuple('Stage', ['function', 'inputs', 'params', 'outputs'], defaults=[(), {}, ()])
+
+# The analyses, in the order their scripts are usually run; these are the default targets
+ANALYSES = [
+    'stats', 'volume', 'supplier', 'buyers', 'buyerCorrelation', 'marketplace', 'distribution',
+    'seasonality', 'prepForRegression', 'linearRegression', 'weightedMeanLinearRegression', 'predicition',
+    'SpearmansRankCorrelation', 'duplicates', 'methodStats', 'report',
+]
+
+
+# The DAG: the shared preparation stages (load once, derive, clean) and every analysis on top of them.
+# The FX table is a stage of its own, so a changed table changes the digest every EUR price depends on.
+def build_stages(filename=FILENAME, method=BCR_METHOD, as_of=None, fx_filename=FX_FILENAME):
+    cleaned = ('data_subset_cleaned',)
+    both = ('data_subset', 'data_subset_cleaned')
+    return {
+        'data_subset': Stage(load_prepared, (), {'filename': filename, 'method': method, 'as_of': as_of}),
+        'fx_rates': Stage(load_rates, (), {'fx_filename': fx_filename}),
+        'data_subset_cleaned': Stage(clean_prices, ('data_subset', 'fx_rates')),
+        'total_transactions': Stage(count_transactions, (), {'filename': filename, 'as_of': as_of}),
+        'all_transactions_loaded': Stage(load_subset, (), {'filename': filename, 'method': None, 'as_of': as_of}),
+        'all_transactions': Stage(prepare_loaded, ('all_transactions_loaded',)),
+        'all_transactions_cleaned': Stage(clean_prices, ('all_transactions', 'fx_rates')),
+        'cube': Stage(cube.build_cube, both),
+        'stats': Stage(stats.analyze, both, outputs=(stats.OUTPUT_FILENAME,)),
+        'volume': Stage(volume.analyze, ('data_subset',), outputs=(volume.OUTPUT_FILENAME,)),
+        'supplier': Stage(supplier.analyze, cleaned),
+        'buyers': Stage(buyers.analyze, cleaned),
+        'buyerCorrelation': Stage(buyerCorrelation.analyze, cleaned),
+        'marketplace': Stage(marketplace.analyze, cleaned, outputs=(marketplace.OUTPUT_FILENAME,)),
+        'distribution': Stage(distribution.analyze, cleaned, outputs=(distribution.OUTPUT_FILENAME,)),
+        'seasonality': Stage(seasonality.analyze, both, outputs=(seasonality.OUTPUT_FILENAME,)),
+        'prepForRegression': Stage(prepForRegression.analyze, cleaned),
+        'linearRegression': Stage(linearRegression.analyze, ('total_transactions',) + both,
+                                  outputs=(linearRegression.OUTPUT_FILENAME,)),
+        'weightedMeanLinearRegression': Stage(weightedMeanLinearRegression.analyze, ('total_transactions',) + both,
+                                              outputs=(weightedMeanLinearRegression.OUTPUT_FILENAME,)),
+        'predicition': Stage(predicition.analyze, both),
+        'SpearmansRankCorrelation': Stage(SpearmansRankCorrelation.analyze, both),
+        'duplicates': Stage(duplicates.analyze, ('all_transactions_loaded',)),
+        'methodStats': Stage(methodStats.analyze, ('all_transactions', 'all_transactions_cleaned'),
+                             outputs=(methodStats.OUTPUT_FILENAME,)),
+        'report': Stage(report.build_report, tuple(report.REPORT_STAGES), outputs=(report.REPORT_FILENAME,)),
+    }
+
+
+# The targets and every stage they depend on, in an order where each stage follows its inputs and the
+# targets keep the order they were given in
+def execution_order(stages, targets):
+    order = []
+
+    def visit(name, path):
+        if name not in stages:
+            raise ValueError(f"Unknown stage '{name}'. Available: {', '.join(stages)}")
+        if name in path:
+            raise ValueError(f"Stage '{name}' depends on itself: {' -> '.join(path + (name,))}")
+        if name in order:
+            return
+        for input_name in stages[name].inputs:
+            visit(input_name, path + (name,))
+        order.append(name)
+
+    for target in targets:
+        visit(target, ())
+    return order
+
+
+# Handle to a frame written by write_shared; this is what crosses the process boundary instead of the frame.
+# dtypes are the frame's column types, which read_shared restores where an Arrow file gives back another
+# one. Categorical columns are left as Arrow gives them: the same codes and category values (their text as
+# strings rather than objects, which the digest does not tell apart), without a second copy per worker.
+SharedFrame = namedtuple('SharedFrame', ['path', 'dtypes'])
+
+
+def write_shared(frame, path):
+    if SHARED_FORMAT == 'arrow' and object not in (*frame.dtypes, *frame.index.to_frame().dtypes):
+        import pyarrow as pa
+        import pyarrow.ipc  # noqa: F401
+        path = f"{path}.arrow"
+        table = pa.Table.from_pandas(frame)
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        path = f"{path}.pickle"
+        frame.to_pickle(path)
+    return SharedFrame(path, frame.dtypes)
+
+
+# Map a shared frame; every column is a block of its own, so numeric columns without missing values are
+# used in place instead of being copied into one block, and the rest is converted
+def read_shared(shared):
+    if not shared.path.endswith('.arrow'):
+        return pd.read_pickle(shared.path)
+    import pyarrow as pa
+    import pyarrow.ipc  # noqa: F401
+    frame = pa.ipc.open_file(pa.memory_map(shared.path)).read_all().to_pandas(split_blocks=True)
+    changed = {column: dtype for column, dtype in shared.dtypes.items()
+               if frame[column].dtype != dtype and not isinstance(dtype, pd.CategoricalDtype)}
+    return frame.astype(changed) if changed else frame
+
+
+# Plots are only saved in the workers; there is no display to show them on
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+# Call a stage function; with capture, its printed output is collected and returned instead of written.
+# The figures it emits are always collected, also those emitted before a failure. A stage that exits
+# (sys.exit, as the scripts do on bad input) fails like one that raises; only an interrupt stops the run.
+# Returns (output, printed text, figures, error).
+def call_stage(function, inputs, params, capture):
+    printed = io.StringIO()
+    with collect() as figures:
+        try:
+            with contextlib.redirect_stdout(printed) if capture else contextlib.nullcontext():
+                output = function(*inputs, **params)
+            error = None
+        except (Exception, SystemExit) as exc:
+            output, error = None, f"{type(exc).__name__}: {exc}"
+    return output, printed.getvalue(), figures, error
+
+
+# Memo key of a stage run, or None when memoization is off. Stages without inputs (the loaders) are always
+# run: their output is what the keys of everything downstream are derived from.
+def _memo_key(stage, params, digests, memo_dir):
+    if memo_dir is None or not stage.inputs:
+        return None
+    return stage_key(stage.function, params, [digests[i] for i in stage.inputs])
+
+
+# The memoized run of a stage, or None; a stage whose files were deleted, changed or replaced since it wrote
+# them is run again to write them (see stageCache.lookup)
+def _memo_hit(stage, memo_dir, key):
+    if not key:
+        return None
+    return lookup(memo_dir, key, stage.outputs)
+
+
+# Store a computed output (when it has a key) with the files the stage wrote, and return its digest
+def _remember(memo_dir, key, output, printed, figures, files=()):
+    return store(memo_dir, key, output, printed, figures, files) if key else digest(output)
+
+
+# Run one stage in this process, or replay its memoized run when key has one (see _memo_hit). The output
+# is digested when the run is memoized, when memoization is on (memo_dir: the keys downstream derive from
+# the digest) or when keep_digest asks for it. Returns (output, output digest or None, printed text,
+# figures, error, whether the run was replayed).
+def execute_stage(stage, inputs, params, memo_dir, key, capture=True, keep_digest=False):
+    hit = _memo_hit(stage, memo_dir, key)
+    if hit:
+        output, output_digest, printed, figures = hit
+        return output, output_digest, printed, figures, None, True
+    output, printed, figures, error = call_stage(stage.function, inputs, params, capture)
+    output_digest = None
+    if error is None and (memo_dir is not None or keep_digest):
+        output_digest = _remember(memo_dir, key, output, printed, figures, stage.outputs)
+    return output, output_digest, printed, figures, error, False
+
+
+# Run one stage in a worker. The printed output is captured and handed back with the result so the report
+# of each stage stays in one piece; a frame result is shared through a file instead of being pickled.
+# The figures are handed back as specs and rendered by the parent's figure pool.
+# Returns (output, seconds, printed text, figures, error, output digest).
+def _run_stage(name, function, inputs, params, shared_dir, memo_dir, key, files=()):
+    started = time.perf_counter()
+    output_digest = None
+    try:
+        inputs = [read_shared(value) if isinstance(value, SharedFrame) else value for value in inputs]
+        output, printed, figures, error = call_stage(function, inputs, params, capture=True)
+        if error is None and memo_dir is not None:
+            output_digest = _remember(memo_dir, key, output, printed, figures, files)
+        if isinstance(output, pd.DataFrame):
+            output = write_shared(output, os.path.join(shared_dir, name))
+    except (Exception, SystemExit) as exc:
+        output, printed, figures, error = None, '', [], f"{type(exc).__name__}: {exc}"
+    return output, time.perf_counter() - started, printed, figures, error, output_digest
+
+
+# Run the stages on a pool of worker processes: a stage is submitted as soon as all of its inputs are
+# available, so independent analyses run side by side. Memo hits are resolved here without a worker, and so
+# are the stages that took less than PARALLEL_MIN_SECONDS on their last run (seconds: {stage: seconds}),
+# which would cost more in start-up and hand-over than they save. The stages without inputs (the loaders)
+# run one at a time: the first of them builds the columnar cache the others then read.
+def _run_parallel(stages, order, params, workers, memo_dir, render, replayed, seconds=None):
+    seconds = seconds or {}
+    outputs, timings, errors, digests = {}, {}, {}, {}
+    # Frames of the shared outputs this process has read (or computed) itself
+    frames = {}
+    pending = list(order)
+    running = {}
+
+    def value(name):
+        if not isinstance(outputs[name], SharedFrame):
+            return outputs[name]
+        if name not in frames:
+            frames[name] = read_shared(outputs[name])
+        return frames[name]
+
+    def finish(name, output, printed, figures, error):
+        sys.stdout.write(printed)
+        render(name, figures)
+        if error is not None:
+            errors[name] = error
+        elif isinstance(output, pd.DataFrame):
+            frames[name] = output
+            outputs[name] = write_shared(output, os.path.join(shared_dir, name))
+        else:
+            outputs[name] = output
+
+    with tempfile.TemporaryDirectory(dir=SHARED_DIR, ignore_cleanup_errors=True) as shared_dir, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        while pending or running:
+            for name in list(pending):
+                stage = stages[name]
+                failed = [i for i in stage.inputs if i in errors]
+                if failed:
+                    errors[name] = f"skipped, input '{failed[0]}' failed"
+                    pending.remove(name)
+                elif not stage.inputs and any(not stages[other].inputs for other in running.values()):
+                    continue
+                elif all(i in outputs for i in stage.inputs):
+                    pending.remove(name)
+                    started = time.perf_counter()
+                    kwargs = {**stage.params, **params.get(name, {})}
+                    key = _memo_key(stage, kwargs, digests, memo_dir)
+                    hit = _memo_hit(stage, memo_dir, key)
+                    if hit:
+                        output, digests[name], printed, figures = hit
+                        replayed.append(name)
+                        finish(name, output, printed, figures, None)
+                    elif seconds.get(name, PARALLEL_MIN_SECONDS) < PARALLEL_MIN_SECONDS:
+                        output, printed, figures, error = call_stage(
+                            stage.function, [value(i) for i in stage.inputs], kwargs, capture=True,
+                        )
+                        if error is None and memo_dir is not None:
+                            digests[name] = _remember(memo_dir, key, output, printed, figures, stage.outputs)
+                        finish(name, output, printed, figures, error)
+                    else:
+                        future = pool.submit(
+                            _run_stage, name, stage.function, [outputs[i] for i in stage.inputs],
+                            kwargs, shared_dir, memo_dir, key, stage.outputs,
+                        )
+                        running[future] = name
+                        continue
+                    timings[name] = time.perf_counter() - started
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    output, timings[name], printed, figures, error, output_digest = future.result()
+                except (Exception, SystemExit) as exc:
+                    # e.g. a result that cannot be pickled back to this process
+                    output, printed, figures, error = None, '', [], f"{type(exc).__name__}: {exc}"
+                sys.stdout.write(printed)
+                render(name, figures)
+                if error is None:
+                    outputs[name] = output
+                    digests[name] = output_digest
+                else:
+                    errors[name] = error
+        outputs = {name: value(name) for name in outputs}
+    return outputs, timings, errors
+
+
+# Run the stages one after the other in this process
+def _run_serial(stages, order, params, memo_dir, render, replayed):
+    outputs, timings, errors, digests = {}, {}, {}, {}
+    for name in order:
+        stage = stages[name]
+        failed = [i for i in stage.inputs if i in errors]
+        if failed:
+            errors[name] = f"skipped, input '{failed[0]}' failed"
+            continue
+        started = time.perf_counter()
+        kwargs = {**stage.params, **params.get(name, {})}
+        key = _memo_key(stage, kwargs, digests, memo_dir)
+        output, output_digest, printed, figures, error, hit = execute_stage(
+            stage, [outputs[i] for i in stage.inputs], kwargs, memo_dir, key, capture=memo_dir is not None,
+        )
+        if hit:
+            replayed.append(name)
+        if output_digest is not None:
+            digests[name] = output_digest
+        sys.stdout.write(printed)
+        render(name, figures)
+        if error is None:
+            outputs[name] = output
+        else:
+            errors[name] = error
+        timings[name] = time.perf_counter() - started
+    return outputs, timings, errors
+
+
+# Run the targets in one process: every stage runs once, in dependency order, and receives the outputs of
+# its inputs by name, so the export is loaded and prepared once for all analyses. params overrides the
+# keyword parameters per stage, e.g. {'prepForRegression': {'order': (2, 0, 1)}}.
+# A failing stage does not stop the others; only the stages depending on it are skipped.
+# With workers > 1 the stages run on that many processes instead (see _run_parallel), at most one per core:
+# with a single core the run stays serial. With seconds_path, the seconds each stage took when it last ran
+# are kept in that JSON file, so a parallel run knows which stages are too cheap to hand to a worker.
+# With memo_dir, stage outputs are memoized there (see stageCache.py): a stage whose code, parameters and
+# input data are unchanged is not run again, its output, printed report and figures are replayed from disk.
+# Its other files (exports) are the ones written when it last ran, unless one of its declared outputs is
+# missing; the names of the replayed stages are appended to replayed. The folder is trimmed to max_cache_bytes.
+# The figures the stages emit (see plotting.py) are rendered headless on a separate pool of render_workers
+# processes while the stages go on, in every format of formats; a figure that fails is reported as an error
+# of its stage. With figure_cache, a figure whose data and style are unchanged is copied from the image
+# cache instead of being drawn again.
+# Returns ({stage: output}, {stage: seconds}, {stage: error}).
+def run_pipeline(targets=ANALYSES, stages=None, params=None, workers=None, memo_dir=None,
+                 max_cache_bytes=MAX_CACHE_BYTES, render_workers=None, formats=FORMATS, figure_cache=True,
+                 replayed=None, seconds_path=None):
+    stages = build_stages() if stages is None else stages
+    params = params or {}
+    replayed = [] if replayed is None else replayed
+    order = execution_order(stages, targets)
+    workers = None if workers is None else min(workers, os.cpu_count() or 1)
+    seconds = {}
+    if seconds_path is not None:
+        try:
+            with open(seconds_path) as f:
+                seconds = json.load(f)
+        except (OSError, ValueError):
+            seconds = {}
+    rendering = []
+    with render_pool(render_workers) as figure_pool:
+        def render(name, figures):
+            for spec in figures:
+                rendering.append((name, spec, figure_pool.submit(render_figure, spec, formats, figure_cache)))
+
+        if workers is not None and workers > 1:
+            outputs, timings, errors = _run_parallel(stages, order, params, workers, memo_dir, render, replayed,
+                                                     seconds)
+        else:
+            outputs, timings, errors = _run_serial(stages, order, params, memo_dir, render, replayed)
+        for name, spec, future in rendering:
+            try:
+                future.result()
+            except Exception as exc:
+                errors[f"{name} figure {spec.path}"] = f"{type(exc).__name__}: {exc}"
+    if seconds_path is not None:
+        # Replayed stages say nothing about what running them costs
+        seconds.update({name: timings[name] for name in timings if name not in replayed})
+        os.makedirs(os.path.dirname(os.path.abspath(seconds_path)), exist_ok=True)
+        temporary = f"{seconds_path}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(seconds, f, indent=2)
+        os.replace(temporary, seconds_path)
+    if figure_cache:
+        evict_figures([spec for _, spec, _ in rendering])
+    if memo_dir is not None:
+        evict(memo_dir, max_cache_bytes)
+    return outputs, timings, errors
+
+
+# (mtime, size) of each file, None for a missing one
+def file_signature(files):
+    signature = []
+    for path in files:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+# The Python modules next to this one: the analyses and every helper the stages are built from
+def module_files():
+    return sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py')))
+
+
+# Run the pipeline (this script with arguments) now and again whenever one of inputs changes or one of
+# outputs changes or disappears, until interrupted. Every run is a fresh process, so edited modules are
+# picked up; with the memo it recomputes only the stages whose code (or a helper module's), parameters or
+# input data changed, or whose workbook was changed or removed, and replays the others. The memo entries
+# of the runs that wrote a changed output are dropped from memo_dir first, so its stage writes it again.
+# The outputs are compared with their state after the last run, so the files a run writes do not trigger
+# the next one. run, when given, is called with arguments instead of starting this script.
+def watch(arguments, inputs, outputs, poll_seconds=WATCH_SECONDS, memo_dir=None, run=None):
+    files = list(inputs) + list(outputs)
+    seen = None
+    try:
+        while True:
+            current = file_signature(inputs) + file_signature(outputs)
+            if current != seen:
+                if seen is not None:
+                    changed = [path for path, before, after in zip(files, seen, current) if before != after]
+                    print(f"\nChanged: {', '.join(changed)}")
+                    if memo_dir is not None:
+                        forget(memo_dir, [path for path in changed if path in outputs])
+                if run is None:
+                    subprocess.run([sys.executable, os.path.abspath(__file__)] + list(arguments))
+                else:
+                    run(arguments)
+                seen = current[:len(inputs)] + file_signature(outputs)
+                print(f"Watching {len(files)} files for changes (Ctrl+C to stop)")
+            time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    # Usage: python pipeline.py [--as-of YYYY-MM-DD|VERSION] [--workers N] [--formats png,svg] [--no-memo] [--watch]
+    # [stage ...] (default: all analyses). --workers 0 uses one process per core; --no-memo runs every stage
+    # and draws every figure again; --watch runs again whenever the export, the FX table, a module or a
+    # workbook changes (see watch).
+    arguments = sys.argv[1:]
+    watching = '--watch' in arguments
+    run_arguments = [argument for argument in arguments if argument != '--watch']
+    memoize = '--no-memo' not in arguments
+    arguments = [argument for argument in run_arguments if argument != '--no-memo']
+    options = {'--as-of': None, '--workers': None, '--formats': None}
+    for option in options:
+        if option in arguments:
+            position = arguments.index(option)
+            options[option] = arguments[position + 1]
+            del arguments[position:position + 2]
+    as_of = options['--as-of']
+    workers = None if options['--workers'] is None else int(options['--workers']) or os.cpu_count()
+    stages = build_stages(as_of=as_of)
+    targets = arguments or ANALYSES
+    memo_dir = os.path.join(cache_dir(FILENAME), MEMO_DIRNAME) if memoize else None
+
+    if watching:
+        workbooks = [path for name in execution_order(stages, targets) for path in stages[name].outputs]
+        watch(run_arguments, [FILENAME, FX_FILENAME] + module_files(), workbooks, memo_dir=memo_dir)
+        sys.exit(0)
+
+    formats = FORMATS if options['--formats'] is None else tuple(options['--formats'].split(','))
+
+    replayed = []
+    outputs, timings, errors = run_pipeline(
+        targets, stages=stages, workers=workers, memo_dir=memo_dir, formats=formats, figure_cache=memoize,
+        replayed=replayed, seconds_path=os.path.join(cache_dir(FILENAME), STAGE_SECONDS_NAME),
+    )
+
+    print("\nStage timings:")
+    for name, seconds in timings.items():
+        print(f"   {name}: {seconds:.2f} s{' (memo)' if name in replayed else ''}")
+    for name, error in errors.items():
+        print(f"Stage '{name}' failed: {error}")
+    sys.exit(1 if errors else 0)
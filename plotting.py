@@ -0,0 +1,304 @@
+import contextlib
+import inspect
+import os
+import shutil
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from stageCache import digest, evict
+
+# Formats every figure is written in; add 'svg' or 'pdf' for vector output
+FORMATS = ('png',)
+
+# Folder (next to the figures) holding rendered images by content hash, and the size it is trimmed to
+FIGURE_CACHE_DIRNAME = '.figure_cache'
+MAX_FIGURE_CACHE_BYTES = 256 << 20
+
+# Bumped whenever the figure key derivation changes, so old images are never reused
+FIGURE_CACHE_VERSION = 1
+
+# A figure to render: the renderer (a key of RENDERERS), the output path (an extension is replaced by
+# each format), the data it plots and its style. The style holds the renderer's keyword arguments plus
+# optional 'rc' (rcParams for this figure) and 'savefig' (keyword arguments of savefig).
+FigureSpec = namedtuple('FigureSpec', ['kind', 'path', 'data', 'style'])
+
+# Lists collecting the specs emitted inside collect() blocks, innermost last
+_collectors = []
+
+
+# Hand a figure to the innermost collect() block, or render it right away when there is none
+def emit(spec):
+    if _collectors:
+        _collectors[-1].append(spec)
+    else:
+        render_figure(spec)
+
+
+# Collect the figures emitted by the code inside the block instead of rendering them one by one
+@contextlib.contextmanager
+def collect():
+    figures = []
+    _collectors.append(figures)
+    try:
+        yield figures
+    finally:
+        _collectors.pop()
+
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+# Bar chart of values per key with the number of transactions of each key written above its bar
+def _annotated_bar(values, counts, figsize=(20, 8), dpi=300, color='skyblue', xlabel='', ylabel='', title='',
+                   rotation=45, rotation_mode='anchor', annotation_fontsize=16):
+    plt = _pyplot()
+    fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
+    values.plot(kind='bar', color=color, ax=ax)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    plt.xticks(rotation=rotation, ha='right', rotation_mode=rotation_mode)
+    ax.grid(True)
+    plt.tight_layout()
+    for i, key in enumerate(values.index):
+        ax.text(i, values.iloc[i] + 2, f'{counts[key]}', ha='center', va='bottom', fontsize=annotation_fontsize)
+    return fig
+
+
+# Scatter plot with one series per group, e.g. the transactions of each marketplace over time
+def _group_scatter(frame, x, y, group, figsize=(12, 8), dpi=300, s=50, xlabel='', ylabel='', title='',
+                   label_fontsize=None, xticks_rotation=45, xticks_fontsize=None, legend=None, grid=None,
+                   ylim=None, note=None):
+    plt = _pyplot()
+    fig = plt.figure(figsize=figsize, dpi=dpi)
+    for name, rows in frame.groupby(group, observed=True):
+        plt.scatter(rows[x], rows[y], label=name, s=s)
+    plt.xlabel(xlabel, fontsize=label_fontsize)
+    plt.ylabel(ylabel, fontsize=label_fontsize)
+    plt.title(title, fontsize=label_fontsize)
+    plt.xticks(rotation=xticks_rotation, fontsize=xticks_fontsize)
+    if ylim is not None:
+        plt.ylim(*ylim)
+    plt.legend(**(legend or {}))
+    plt.grid(True, **(grid or {}))
+    if note is not None:
+        plt.figtext(0.5, -0.1, note, ha="center", fontsize=10, style="italic")
+    return fig
+
+
+def _histogram(values, bins=30, kde=True, figsize=(10, 6), title='', xlabel='', ylabel=''):
+    import seaborn as sns
+    plt = _pyplot()
+    fig = plt.figure(figsize=figsize)
+    sns.histplot(values, bins=bins, kde=kde)
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.grid(axis='y', linestyle='--', alpha=0.7)
+    return fig
+
+
+def _boxplot(values, figsize=(10, 6), title='', xlabel=''):
+    import seaborn as sns
+    plt = _pyplot()
+    fig = plt.figure(figsize=figsize)
+    sns.boxplot(x=values)
+    plt.title(title)
+    plt.xlabel(xlabel)
+    return fig
+
+
+# Line plot of one series; grid holds the keyword arguments of plt.grid
+def _line(x, y, figsize=(12, 6), label=None, xlabel='', ylabel='', title='', xticks_rotation=None, grid=None):
+    plt = _pyplot()
+    fig = plt.figure(figsize=figsize)
+    plt.plot(x, y, marker='o', linestyle='-', label=label)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.title(title)
+    if label is not None:
+        plt.legend()
+    if xticks_rotation is not None:
+        plt.xticks(rotation=xticks_rotation)
+    plt.grid(**(grid or {'visible': True}))
+    return fig
+
+
+# One line per year over the months of a month x year pivot
+def _month_year_lines(pivot, figsize=(12, 6), xlabel='', ylabel='', title=''):
+    import seaborn as sns
+    plt = _pyplot()
+    fig = plt.figure(figsize=figsize)
+    sns.lineplot(data=pivot, marker="o")
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.title(title)
+    plt.xticks(ticks=range(1, 13), labels=['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])
+    plt.legend(title="Year", loc="upper right")
+    plt.grid(axis='y', linestyle='--', alpha=0.7)
+    return fig
+
+
+# Autocorrelation and partial autocorrelation side by side
+def _acf_pacf(values, lags=30, figsize=(12, 6)):
+    from statsmodels.graphics.tsaplots import plot_acf, plot_pacf
+    plt = _pyplot()
+    fig, ax = plt.subplots(1, 2, figsize=figsize)
+    plot_acf(values, ax=ax[0], lags=lags)
+    ax[0].set_title("Autocorrelation Function (ACF)")
+    plot_pacf(values, ax=ax[1], lags=lags)
+    ax[1].set_title("Partial Autocorrelation Function (PACF)")
+    return fig
+
+
+# The observed series followed by the forecast, both indexed by date
+def _forecast(actual, forecast, figsize=(12, 6), xlabel='', ylabel='', title=''):
+    plt = _pyplot()
+    fig = plt.figure(figsize=figsize)
+    plt.plot(actual.index, actual, label='Actual Data', marker='o')
+    plt.plot(forecast.index, forecast, label='Forecast', color='red', linestyle='dashed', marker='o')
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.title(title)
+    plt.legend()
+    plt.grid(True)
+    return fig
+
+
+# Rolling mean and median price over the window ends of timeWindows.rolling_stats
+def _rolling(curve, figsize=(12, 6), xlabel='', ylabel='', title='', xticks_rotation=45):
+    plt = _pyplot()
+    fig = plt.figure(figsize=figsize)
+    plt.plot(curve.index, curve['mean'], label='Rolling mean')
+    plt.plot(curve.index, curve['median'], label='Rolling median', linestyle='--')
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.title(title)
+    plt.xticks(rotation=xticks_rotation)
+    plt.legend()
+    plt.grid(axis='y', linestyle='--', alpha=0.7)
+    return fig
+
+
+def _scatter(x, y, alpha=0.6, label=None, xlabel='', ylabel='', title=''):
+    plt = _pyplot()
+    fig = plt.figure()
+    plt.scatter(x, y, alpha=alpha, label=label)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.title(title)
+    plt.grid(True)
+    plt.legend()
+    return fig
+
+
+RENDERERS = {
+    'annotated_bar': _annotated_bar,
+    'group_scatter': _group_scatter,
+    'histogram': _histogram,
+    'boxplot': _boxplot,
+    'line': _line,
+    'month_year_lines': _month_year_lines,
+    'acf_pacf': _acf_pacf,
+    'forecast': _forecast,
+    'scatter': _scatter,
+    'rolling': _rolling,
+}
+
+
+# Output files of a spec, one per format
+def output_paths(spec, formats=FORMATS):
+    base, extension = os.path.splitext(spec.path)
+    if extension.lower() not in ('.png', '.svg', '.pdf'):
+        base = spec.path
+    return [f"{base}.{fmt}" for fmt in formats]
+
+
+def figure_cache_dir(spec):
+    return os.path.join(os.path.dirname(os.path.abspath(spec.path)), FIGURE_CACHE_DIRNAME)
+
+
+# Content key of a figure: the plotting code (this module), the renderer, the data it plots and its style.
+# The output path is left out, so the same figure written under another name is still a hit.
+def figure_key(spec):
+    try:
+        source = inspect.getsource(sys.modules[__name__])
+    except (OSError, TypeError):
+        source = ''
+    return digest((
+        FIGURE_CACHE_VERSION, source, spec.kind,
+        [(name, spec.data[name]) for name in sorted(spec.data)],
+        [(name, spec.style[name]) for name in sorted(spec.style)],
+    ))
+
+
+# Render one figure with the Agg backend and write it in every format; returns the written paths.
+# With cache, images are kept in figure_cache_dir by figure_key and a format already rendered for the
+# same data and style is copied from there instead of being drawn again.
+def render_figure(spec, formats=FORMATS, cache=True):
+    paths = output_paths(spec, formats)
+    if not cache:
+        _draw(spec, list(zip(paths, formats)))
+        return paths
+    directory = figure_cache_dir(spec)
+    key = figure_key(spec)
+    cached = [os.path.join(directory, f"{key}.{fmt}") for fmt in formats]
+    missing = [(path, fmt) for path, fmt in zip(cached, formats) if not os.path.exists(path)]
+    if missing:
+        os.makedirs(directory, exist_ok=True)
+        # Draw to temporary names first: concurrent renderers never copy a half-written image
+        temporary = [(f"{path}.{os.getpid()}.tmp", fmt) for path, fmt in missing]
+        _draw(spec, temporary)
+        for (path, _), (written, _) in zip(missing, temporary):
+            os.replace(written, path)
+    for source, path in zip(cached, paths):
+        shutil.copyfile(source, path)
+        # A hit counts as a use for the least recently used eviction
+        os.utime(source)
+    return paths
+
+
+# Draw the figure once and save it to every (path, format) pair
+def _draw(spec, targets):
+    plt = _pyplot()
+    style = dict(spec.style)
+    rc = style.pop('rc', {})
+    savefig = style.pop('savefig', {})
+    with plt.rc_context(rc):
+        fig = RENDERERS[spec.kind](**spec.data, **style)
+        try:
+            for path, fmt in targets:
+                fig.savefig(path, format=fmt, **savefig)
+        finally:
+            plt.close(fig)
+
+
+# Trim the image caches of the given figures to max_bytes each, least recently used images first
+def evict_figures(figures, max_bytes=MAX_FIGURE_CACHE_BYTES):
+    for directory in {figure_cache_dir(spec) for spec in figures}:
+        evict(directory, max_bytes, suffixes=tuple(f".{fmt}" for fmt in ('png', 'svg', 'pdf', 'jpg', 'eps')))
+
+
+# Start a pool for render_figures; plotting libraries are imported by the workers, not here
+def render_pool(workers=None):
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+
+
+# Render figures side by side on a process pool (a fresh one unless pool is given); a single figure or
+# workers=1 renders in this process. Figures already in the image cache are only copied. Returns the
+# written paths per figure.
+def render_figures(figures, workers=None, formats=FORMATS, pool=None, cache=True):
+    figures = list(figures)
+    if pool is None and (len(figures) <= 1 or workers == 1):
+        paths = [render_figure(spec, formats, cache) for spec in figures]
+    else:
+        with contextlib.nullcontext(pool) if pool is not None else render_pool(workers) as executor:
+            paths = list(executor.map(render_figure, figures, [formats] * len(figures), [cache] * len(figures)))
+    if cache:
+        evict_figures(figures)
+    return paths
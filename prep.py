@@ -0,0 +1,95 @@
+import contextlib
+import sys
+
+import numpy as np
+import pandas as pd
+
+from currency import to_eur
+from loader import BCR_METHOD, COLUMNS_TO_KEEP, FILENAME, load_transactions
+from timeIndex import sort_by_date
+
+# Errors of reading the export; load_subset raises them with the message the scripts print
+LOAD_ERRORS = (FileNotFoundError, pd.errors.EmptyDataError, pd.errors.ParserError)
+
+
+# Read only the needed columns of one method (all methods with method=None); the projection and the
+# method filter are applied while reading. With as_of, the rows come from the snapshot store instead.
+def load_subset(filename=FILENAME, method=BCR_METHOD, as_of=None):
+    try:
+        if as_of is None:
+            data_subset = load_transactions(filename, method=method, columns=COLUMNS_TO_KEEP)
+        else:
+            # Imported here: the store itself builds on the streaming statistics, which use this module
+            from store import load_as_of, store_dir
+            data_subset = load_as_of(store_dir(filename), as_of, method=method, columns=COLUMNS_TO_KEEP)
+        print("Data loaded successfully!")
+    except FileNotFoundError as exc:
+        raise FileNotFoundError(f"The file '{filename}' was not found.") from exc
+    except pd.errors.EmptyDataError as exc:
+        raise pd.errors.EmptyDataError("The file is empty.") from exc
+    except pd.errors.ParserError as exc:
+        raise pd.errors.ParserError("There was an issue parsing the file.") from exc
+    return data_subset
+
+
+# For the entry points of the scripts: a load error raised in the block is reported and exits with status 1
+# (stages of the pipeline and the daemon get the exception itself)
+@contextlib.contextmanager
+def exit_on_load_error():
+    try:
+        yield
+    except LOAD_ERRORS as exc:
+        print(f"Error: {exc}")
+        sys.exit(1)
+
+
+# Ensure 'announcement_date' is in datetime format and add the 'announcement_year' and
+# 'price_per_ton_USD' columns
+def derive_prices(data_subset):
+    data_subset['announcement_date'] = pd.to_datetime(data_subset['announcement_date'], errors='coerce')
+    data_subset['announcement_year'] = data_subset['announcement_date'].dt.year
+    data_subset['price_per_ton_USD'] = data_subset['price_usd'] / data_subset['tons_purchased']
+    return data_subset
+
+
+# Drop rows without price or with an infinite price, then add the 'price_per_ton_EUR' column, converted at
+# the USD/EUR rate of each announcement date (rates: a table from currency.load_rates, the local one by default)
+def clean_prices(data_subset, rates=None):
+    data_subset_cleaned = data_subset.dropna(subset=['price_per_ton_USD'])
+    data_subset_cleaned = data_subset_cleaned[~np.isinf(data_subset_cleaned['price_per_ton_USD'])].copy()
+    data_subset_cleaned['price_per_ton_EUR'] = to_eur(
+        data_subset_cleaned['price_per_ton_USD'], data_subset_cleaned['announcement_date'], rates
+    )
+    return data_subset_cleaned
+
+
+# Load and derive: the 'data_subset' every analysis starts from. Its rows are sorted by announcement date
+# (index labels kept), so date ranges are slices (see timeIndex.transactions_between).
+def load_prepared(filename=FILENAME, method=BCR_METHOD, as_of=None):
+    return sort_by_date(derive_prices(load_subset(filename, method=method, as_of=as_of)))
+
+
+# The same from rows already loaded by load_subset, which are left as they were read (the pipeline also
+# hands them to analyses working on the raw rows, see duplicates.py)
+def prepare_loaded(data_subset):
+    return sort_by_date(derive_prices(data_subset.copy()))
+
+
+# Load, derive and clean in one go: returns (data_subset, data_subset_cleaned)
+def prepare(filename=FILENAME, method=BCR_METHOD, as_of=None, rates=None):
+    data_subset = load_prepared(filename, method=method, as_of=as_of)
+    return data_subset, clean_prices(data_subset, rates=rates)
+
+
+# The regression scripts work on the USD price rounded to two decimals and on the number of days since
+# the first announcement. Returns copies of (data_subset, data_subset_cleaned) with both columns set, in
+# the order the rows were loaded: the random train/test splits depend on the row order.
+def regression_frames(data_subset, data_subset_cleaned):
+    start = data_subset['announcement_date'].min()
+    frames = []
+    for frame in (data_subset, data_subset_cleaned):
+        frame = frame.sort_index()
+        frame['price_per_ton_USD'] = frame['price_per_ton_USD'].round(2)
+        frame['days_since_start'] = (frame['announcement_date'] - start).dt.days
+        frames.append(frame)
+    return frames
@@ -0,0 +1,172 @@
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from excelExport import DATETIME_FORMAT, EXCEL_ENGINE, write_workbook
+from stageCache import digest
+
+# Workbook holding the tables of every analysis in one place
+REPORT_FILENAME = 'cdr_report.xlsx'
+
+# Folder next to the report that keeps the rendered sheets of its last build, one XML part per content hash
+SHEET_CACHE_DIRNAME = '.report_cache'
+
+# Bumped whenever the sheets' layout changes, so cached sheets are rendered again
+REPORT_VERSION = 1
+
+# The stages the report takes its tables from, in build_report's argument order
+REPORT_STAGES = [
+    'stats', 'volume', 'marketplace', 'distribution', 'linearRegression', 'weightedMeanLinearRegression',
+    'predicition', 'SpearmansRankCorrelation',
+]
+
+
+# One table of regression and correlation metrics: model, metric and value per row
+def regression_metrics(linear, weighted, prediction, spearman):
+    rows = [('Linear regression (mean price)', metric, value) for metric, value in linear[2].itertuples(index=False)]
+    rows += [('Linear regression (weighted mean price)', metric, value)
+             for metric, value in weighted[2].itertuples(index=False)]
+    rows += [('Prediction', 'Mean Squared Error', prediction[0]), ('Prediction', 'R-squared', prediction[1])]
+    rows += [("Spearman's rank correlation", 'Correlation', spearman[0]),
+             ("Spearman's rank correlation", 'p-value', spearman[1])]
+    return pd.DataFrame(rows, columns=['Model', 'Metric', 'Value']).astype({'Value': 'float64'})
+
+
+# The report's sheets ({sheet name: frame}, in order) from the outputs of REPORT_STAGES, and the names of
+# the sheets written with their index
+def report_tables(stats, volume, marketplace, distribution, linear, weighted, prediction, spearman):
+    sheets = {
+        'Statistics per year': stats[0],
+        'Stats total': stats[1],
+        'Volume per year': volume,
+        'Marketplaces > 200 EUR per ton': marketplace[0],
+        'Price distribution': distribution[0].to_frame(name='price_per_ton_EUR'),
+        'Transaction summary': distribution[1],
+        'Transaction stats': linear[1],
+        'Regression metrics': regression_metrics(linear, weighted, prediction, spearman),
+    }
+    return sheets, ['Marketplaces > 200 EUR per ton', 'Price distribution']
+
+
+def _sheet_key(frame, index):
+    return hashlib.sha256(repr((REPORT_VERSION, bool(index), digest(frame))).encode()).hexdigest()
+
+
+# Render one sheet as the worksheet part of a one-sheet workbook; the cell styles it refers to are the
+# same in every workbook written by excelExport (header first, then dates), so the part fits any of them
+def render_sheet(frame, index, part_path):
+    temporary = f"{part_path}.{os.getpid()}.tmp"
+    write_workbook(temporary, {'Sheet': frame}, index=['Sheet'] if index else [], engine='xlsxwriter')
+    with zipfile.ZipFile(temporary) as workbook:
+        part = workbook.read('xl/worksheets/sheet1.xml')
+    with open(temporary, 'wb') as f:
+        f.write(part)
+    os.replace(temporary, part_path)
+    return part_path
+
+
+# Write the workbook from the rendered parts: an empty workbook with the sheet names (and the header and
+# date styles the parts use) whose worksheets are then swapped for the parts
+def _assemble(path, names, parts):
+    import xlsxwriter
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    skeleton = f"{temporary}.skeleton"
+    workbook = xlsxwriter.Workbook(skeleton, {'constant_memory': True, 'default_date_format': DATETIME_FORMAT})
+    bold = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+    for number, name in enumerate(names):
+        worksheet = workbook.add_worksheet(name)
+        if number == 0:
+            worksheet.write(0, 0, '', bold)
+            worksheet.write_datetime(1, 0, datetime.datetime(2000, 1, 1))
+    workbook.close()
+
+    with zipfile.ZipFile(skeleton) as source, \
+            zipfile.ZipFile(temporary, 'w', compression=zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            content = source.read(item.filename)
+            if item.filename.startswith('xl/worksheets/sheet') and item.filename.endswith('.xml'):
+                number = int(item.filename[len('xl/worksheets/sheet'):-len('.xml')])
+                with open(parts[number - 1], 'rb') as f:
+                    content = f.read()
+                if number > 1:
+                    # Only the first sheet is the selected one
+                    content = content.replace(b' tabSelected="1"', b'', 1)
+            target.writestr(item, content)
+    os.remove(skeleton)
+    os.replace(temporary, path)
+
+
+# Write the report workbook in one pass from the outputs of REPORT_STAGES (see report_tables).
+# Each sheet is keyed by the hash of its content: sheets unchanged since the last build are reused as
+# rendered then, only the others are rendered, side by side on workers processes when there are several;
+# when no sheet changed and the report exists it is not written at all. Without xlsxwriter the workbook is
+# written sheet after sheet by write_workbook and only the skip of an unchanged report applies.
+# Returns the tables.
+def build_report(stats, volume, marketplace, distribution, linear, weighted, prediction, spearman,
+                 path=REPORT_FILENAME, workers=None):
+    sheets, index = report_tables(stats, volume, marketplace, distribution, linear, weighted, prediction, spearman)
+    keys = {name: _sheet_key(frame, name in index) for name, frame in sheets.items()}
+    cache = os.path.join(os.path.dirname(os.path.abspath(path)), SHEET_CACHE_DIRNAME)
+    manifest_path = os.path.join(cache, f"{os.path.basename(path)}.json")
+    manifest = [[name, keys[name]] for name in sheets]
+    try:
+        with open(manifest_path) as f:
+            unchanged = json.load(f) == manifest and os.path.exists(path)
+    except (OSError, ValueError):
+        unchanged = False
+    if unchanged:
+        print(f"Report '{path}' is up to date ({len(sheets)} sheets unchanged).")
+        return sheets
+
+    os.makedirs(cache, exist_ok=True)
+    if EXCEL_ENGINE == 'xlsxwriter':
+        parts = {name: os.path.join(cache, f"{keys[name]}.xml") for name in sheets}
+        stale = [name for name in sheets if not os.path.exists(parts[name])]
+        if len(stale) > 1 and workers != 1:
+            with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count(), len(stale))) as pool:
+                list(pool.map(render_sheet, [sheets[name] for name in stale], [name in index for name in stale],
+                              [parts[name] for name in stale]))
+        else:
+            for name in stale:
+                render_sheet(sheets[name], name in index, parts[name])
+        _assemble(path, list(sheets), [parts[name] for name in sheets])
+        # Keep only the parts of this build
+        for entry in os.listdir(cache):
+            if entry.endswith('.xml') and os.path.join(cache, entry) not in parts.values():
+                os.remove(os.path.join(cache, entry))
+    else:
+        stale = list(sheets)
+        write_workbook(path, sheets, index=index)
+
+    with open(f"{manifest_path}.tmp", 'w') as f:
+        json.dump(manifest, f)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+    print(f"Report written to '{path}': {len(stale)} of {len(sheets)} sheets rendered"
+          f"{' (' + ', '.join(stale) + ')' if stale and len(stale) < len(sheets) else ''}.")
+    return sheets
+
+
+if __name__ == '__main__':
+    # Usage: python report.py [--no-memo]
+    # Runs the stages the report needs through the pipeline (replaying the memoized ones) and writes it
+    from loader import FILENAME, cache_dir
+    from pipeline import run_pipeline
+    from stageCache import MEMO_DIRNAME
+
+    if '--no-memo' in sys.argv:
+        memo_dir = None
+        shutil.rmtree(SHEET_CACHE_DIRNAME, ignore_errors=True)
+    else:
+        memo_dir = os.path.join(cache_dir(FILENAME), MEMO_DIRNAME)
+    outputs, timings, errors = run_pipeline(['report'], memo_dir=memo_dir)
+    for name, error in errors.items():
+        print(f"Stage '{name}' failed: {error}")
+    sys.exit(1 if errors else 0)
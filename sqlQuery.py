@@ -0,0 +1,118 @@
+import importlib.util
+import sqlite3
+import sys
+import time
+
+import pandas as pd
+
+from loader import BCR_METHOD, FILENAME
+from prep import clean_prices, exit_on_load_error, load_prepared
+
+# DuckDB scans the registered frames in place with vectorized execution; without it the tables are copied
+# once into an in-memory SQLite database. Only look it up here: duckdb is imported when connecting
+SQL_ENGINE = 'duckdb' if importlib.util.find_spec('duckdb') else 'sqlite'
+
+# Tables every connection exposes:
+# - transactions: every transaction of every method with the derived announcement_year and
+#   price_per_ton_USD/EUR columns (NULL prices for the rows without one)
+# - cleaned: the transactions with a price, every method (the 'data_subset_cleaned' of all methods)
+# - bcr: the cleaned BCR transactions the thesis scripts analyse
+TABLES = ['transactions', 'cleaned', 'bcr']
+
+# Columns SQLite gets an index on, the usual filters and group keys
+SQLITE_INDEXES = ['method', 'announcement_year', 'marketplace_name', 'supplier_name', 'purchaser_name']
+
+
+# The prepared tables of an export (as of a snapshot date with as_of, see store.py), by name
+def prepared_tables(filename=FILENAME, as_of=None):
+    transactions = load_prepared(filename, method=None, as_of=as_of)
+    return frame_tables(transactions, clean_prices(transactions))
+
+
+# The tables from the prepared transactions of every method and their cleaned rows
+def frame_tables(transactions, cleaned):
+    transactions = transactions.assign(price_per_ton_EUR=cleaned['price_per_ton_EUR'])
+    return {
+        'transactions': transactions,
+        'cleaned': cleaned,
+        'bcr': cleaned[cleaned['method'] == BCR_METHOD],
+    }
+
+
+# SQLite stores no categoricals or timestamps: entities become text, dates ISO strings
+# ('YYYY-MM-DD HH:MM:SS', so they compare and sort as dates)
+def _sqlite_frame(frame):
+    frame = frame.copy()
+    for column in frame.columns:
+        if isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = frame[column].astype(object)
+        elif pd.api.types.is_datetime64_any_dtype(frame[column]):
+            frame[column] = frame[column].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return frame
+
+
+# An in-process connection with the prepared tables registered (tables: {name: frame}, by default
+# prepared_tables of the export). Pass it to query() to run any number of statements against it.
+def connect(filename=FILENAME, as_of=None, tables=None, engine=SQL_ENGINE):
+    tables = prepared_tables(filename, as_of) if tables is None else tables
+    if engine == 'duckdb':
+        import duckdb
+        connection = duckdb.connect()
+        for name, frame in tables.items():
+            connection.register(name, frame)
+        return connection
+
+    connection = sqlite3.connect(':memory:', check_same_thread=False)
+    for name, frame in tables.items():
+        _sqlite_frame(frame).to_sql(name, connection, index=False)
+        for column in SQLITE_INDEXES:
+            if column in frame:
+                connection.execute(f'CREATE INDEX "{name}_{column}" ON "{name}" ("{column}")')
+    return connection
+
+
+# Run one SQL statement and return its result as a DataFrame
+def query(sql, connection):
+    if isinstance(connection, sqlite3.Connection):
+        return pd.read_sql_query(sql, connection)
+    return connection.execute(sql).df()
+
+
+if __name__ == '__main__':
+    # Usage: python sqlQuery.py [--as-of YYYY-MM-DD] ["SELECT ..." ...]
+    # Runs the given statements, or reads one statement per line from the prompt (empty line or EOF ends).
+    # e.g. python sqlQuery.py "SELECT marketplace_name, COUNT(*) AS n, AVG(price_per_ton_EUR) AS avg_EUR
+    #                          FROM bcr WHERE price_per_ton_EUR > 200 GROUP BY marketplace_name"
+    arguments = sys.argv[1:]
+    as_of = None
+    if '--as-of' in arguments:
+        position = arguments.index('--as-of')
+        as_of = arguments[position + 1]
+        del arguments[position:position + 2]
+
+    with exit_on_load_error():
+        connection = connect(as_of=as_of)
+    print(f"Tables: {', '.join(TABLES)} ({SQL_ENGINE})")
+
+    def statements():
+        yield from arguments
+        if not arguments:
+            while True:
+                try:
+                    line = input('sql> ').strip()
+                except EOFError:
+                    print()
+                    return
+                if not line:
+                    return
+                yield line
+
+    for sql in statements():
+        started = time.perf_counter()
+        try:
+            result = query(sql, connection)
+        except Exception as exc:
+            print(f"Error: {exc}")
+            continue
+        print(result)
+        print(f"({len(result)} rows in {(time.perf_counter() - started) * 1000:.1f} ms)")
@@ -0,0 +1,210 @@
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+
+import pandas as pd
+
+# Folder (inside the export's cache folder) that holds the memoized stage outputs
+MEMO_DIRNAME = 'memo'
+
+# Size the memo folder is trimmed back to after every run, least recently used entries first
+MAX_CACHE_BYTES = 1 << 30
+
+# Bumped whenever the entry layout or the key derivation changes, so old entries are never hit
+MEMO_VERSION = 7
+
+
+# Content digest of a stage output. Frames and series are hashed row by row (values and index) together
+# with their column names, index names and dtypes, tuples, lists and dicts item by item, anything else by
+# its pickle. All NaNs hash alike: arithmetic leaves some with the sign bit set, which a frame shared
+# through Arrow (see pipeline.write_shared) gives back cleared, and the digest must not tell them apart.
+def digest(value):
+    hasher = hashlib.sha256()
+    _update(hasher, value)
+    return hasher.hexdigest()
+
+
+def _update(hasher, value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        columns = list(value.columns) if isinstance(value, pd.DataFrame) else [value.name]
+        dtypes = list(value.dtypes) if isinstance(value, pd.DataFrame) else [value.dtype]
+        hasher.update(repr((type(value).__name__, columns, list(value.index.names),
+                            [str(dtype) for dtype in dtypes])).encode())
+        floats = value.select_dtypes('floating') if isinstance(value, pd.DataFrame) else None
+        if floats is not None and floats.isna().to_numpy().any():
+            value = value.copy()
+            value[floats.columns] = floats.where(floats.notna())
+        elif floats is None and value.dtype.kind == 'f' and value.hasnans:
+            value = value.where(value.notna())
+        hasher.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, (tuple, list)):
+        hasher.update(f"{type(value).__name__}:{len(value)}".encode())
+        for item in value:
+            _update(hasher, item)
+    elif isinstance(value, dict):
+        hasher.update(f"dict:{len(value)}".encode())
+        for name, item in value.items():
+            _update(hasher, name)
+            _update(hasher, item)
+    else:
+        hasher.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+# Sources of a module and of the local modules (files in the same folder) it uses, directly or through one
+# another, ordered by module name; an imported function or class counts for the module defining it
+def local_sources(module):
+    directory = os.path.dirname(os.path.abspath(module.__file__))
+    sources, pending = {}, [module]
+    while pending:
+        current = pending.pop()
+        if current.__name__ in sources:
+            continue
+        sources[current.__name__] = inspect.getsource(current)
+        for value in vars(current).values():
+            if inspect.isfunction(value) or inspect.isclass(value):
+                value = sys.modules.get(value.__module__)
+            file = getattr(value, '__file__', None) if inspect.ismodule(value) else None
+            if file and os.path.dirname(os.path.abspath(file)) == directory:
+                pending.append(value)
+    return [sources[name] for name in sorted(sources)]
+
+
+# Key of one stage run: the source of the module defining the function and of the local modules it uses (so
+# an edit to the analysis or to a helper it calls, e.g. groupStats.py, invalidates it), the keyword
+# parameters and the digests of the inputs in order
+def stage_key(function, params, input_digests):
+    module = sys.modules.get(function.__module__)
+    try:
+        sources = local_sources(module)
+    except (OSError, TypeError, AttributeError):
+        sources = [function.__code__.co_code.hex()]
+    hasher = hashlib.sha256()
+    hasher.update(repr((MEMO_VERSION, function.__module__, function.__qualname__)).encode())
+    for source in sources:
+        hasher.update(source.encode())
+    hasher.update(repr(sorted(params.items())).encode())
+    for input_digest in input_digests:
+        hasher.update(input_digest.encode())
+    return hasher.hexdigest()
+
+
+# An entry holds two pickles: a header (digest, printed text, figures, files) and then the output, so the
+# files a run wrote can be checked without loading its output
+def _entry_path(directory, key):
+    return os.path.join(directory, f"{key}.pkl")
+
+
+def _file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+# {absolute path: (size, modification time, content hash)} of the files a stage wrote
+def file_records(files):
+    records = {}
+    for path in files:
+        stat = os.stat(path)
+        records[os.path.abspath(path)] = (stat.st_size, stat.st_mtime_ns, _file_sha256(path))
+    return records
+
+
+# Whether the files are still the ones recorded: same size and time, or (touched since) the same content
+def files_unchanged(records):
+    for path, (size, mtime_ns, sha256) in records.items():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns) and \
+                (stat.st_size != size or _file_sha256(path) != sha256):
+            return False
+    return True
+
+
+# Return (output, digest, printed text, figure specs) of a memoized run, or None. files are the files the
+# stage writes: the run only counts while each of them is still the one it wrote (see files_unchanged),
+# otherwise the stage has to run again to write them. A hit refreshes the entry's modification time, which
+# is what the LRU eviction orders by.
+def lookup(directory, key, files=()):
+    path = _entry_path(directory, key)
+    try:
+        with open(path, 'rb') as f:
+            header = pickle.load(f)
+            recorded = header['files']
+            if set(recorded) != {os.path.abspath(file) for file in files} or not files_unchanged(recorded):
+                return None
+            output = pickle.load(f)
+        os.utime(path)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    return output, header['digest'], header['printed'], header['figures']
+
+
+# Memoize a stage run and return the digest of its output; files are the files the run wrote, recorded so
+# that lookup can tell when they were changed or replaced since. Outputs that cannot be pickled are not
+# stored (the stage simply runs again next time), nor runs whose files are missing.
+def store(directory, key, output, printed='', figures=(), files=()):
+    output_digest = digest(output)
+    os.makedirs(directory, exist_ok=True)
+    path = _entry_path(directory, key)
+    try:
+        header = {'digest': output_digest, 'printed': printed, 'figures': list(figures),
+                  'files': file_records(files)}
+        content = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL) + \
+            pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError):
+        return output_digest
+    # Write to a temporary name first: concurrent workers never read a half-written entry
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(content)
+    os.replace(temporary, path)
+    return output_digest
+
+
+# Delete the entries of the runs that wrote one of files (reading only their headers); returns the number
+# removed
+def forget(directory, files):
+    files = {os.path.abspath(file) for file in files}
+    if not files or not os.path.isdir(directory):
+        return 0
+    removed = 0
+    for name in os.listdir(directory):
+        if not name.endswith('.pkl'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            with open(path, 'rb') as f:
+                recorded = pickle.load(f)['files']
+            if files.intersection(recorded):
+                os.remove(path)
+                removed += 1
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError):
+            continue
+    return removed
+
+
+# Delete least recently used entries (files ending in one of suffixes) until they take at most max_bytes;
+# returns the number removed
+def evict(directory, max_bytes=MAX_CACHE_BYTES, suffixes=('.pkl',)):
+    if not os.path.isdir(directory):
+        return 0
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith(suffixes):
+            stat = os.stat(os.path.join(directory, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(os.path.join(directory, name))
+        total -= size
+        removed += 1
+    return removed
@@ -0,0 +1,56 @@
+import statistics
+import subprocess
+import sys
+
+# Entry points timed by default
+ENTRY_POINTS = [
+    'pipeline', 'stats', 'volume', 'supplier', 'buyers', 'buyerCorrelation', 'marketplace', 'distribution',
+    'seasonality', 'prepForRegression', 'linearRegression', 'weightedMeanLinearRegression', 'predicition',
+    'SpearmansRankCorrelation', 'duplicates', 'methodStats', 'quantileSketch', 'cube', 'timeWindows', 'timeIndex',
+    'entityIndex', 'sqlQuery', 'analysisDaemon', 'excelExport', 'report', 'store',
+]
+
+# Heavy libraries the analyses use; an entry point should only load them when a stage needs them
+LIBRARIES = [
+    'pyarrow', 'matplotlib.pyplot', 'seaborn', 'scipy.stats', 'sklearn.linear_model',
+    'statsmodels.tsa.arima.model',
+]
+
+# Fresh interpreters per module; the median is reported
+REPEATS = 5
+
+# Run in a new interpreter: time the import itself (interpreter start-up excluded) and list which of the
+# heavy libraries it left in sys.modules
+PROBE = '''
+import sys, time
+started = time.perf_counter()
+import {module}
+print(time.perf_counter() - started)
+print(','.join(name for name in {libraries!r} if name in sys.modules))
+'''
+
+
+# Median import time in seconds of a module and the heavy libraries it loads
+def import_cost(module, repeats=REPEATS):
+    timings = []
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE.format(module=module, libraries=LIBRARIES)],
+            capture_output=True, text=True, check=True,
+        )
+        seconds, loaded = result.stdout.strip().split('\n')
+        timings.append(float(seconds))
+    return statistics.median(timings), [name for name in loaded.split(',') if name]
+
+
+if __name__ == '__main__':
+    # Usage: python startupBenchmark.py [module ...]   (default: every entry point, then the libraries alone)
+    modules = sys.argv[1:] or ENTRY_POINTS + ['pandas'] + LIBRARIES
+    print(f"{'module':<32} {'import (s)':>10}  heavy libraries loaded")
+    for module in modules:
+        try:
+            seconds, loaded = import_cost(module)
+        except subprocess.CalledProcessError as error:
+            print(f"{module:<32} {'failed':>10}  {error.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"{module:<32} {seconds:>10.3f}  {', '.join(loaded) or '-'}")
@@ -1,137 +1,147 @@
 import pandas as pd
-import numpy as np
 import os
+import sys
 
-# Define the filename
-filename = 'Thesis files/CDR_data_Oct_17_2024.csv'
-
-# Read the CSV file into a pandas DataFrame
-try:
-    data = pd.read_csv(filename)
-    print("Data loaded successfully!")
-except FileNotFoundError:
-    print(f"Error: The file '{filename}' was not found.")
-except pd.errors.EmptyDataError:
-    print("Error: The file is empty.")
-except pd.errors.ParserError:
-    print("Error: There was an issue parsing the file.")
-
-# List of columns to include in the subset
-columns_to_keep = [
-    "purchaser_name", "supplier_name", "marketplace_name", "status", 
-    "method", "tons_purchased", "price_usd", "announcement_date", "delivery_date", "tons_delivered"
-]
-
-
-
-# Filter for Biochar Carbon Removal (BCR)
-# Create the subset with the specified columns and filter for Biochar Carbon Removal (BCR)
-data_subset = data[columns_to_keep].copy()[data['method'] == 'Biochar Carbon Removal (BCR)']
-
-# Ensure 'announcement_date' is in datetime format
-data_subset['announcement_date'] = pd.to_datetime(data_subset['announcement_date'], errors='coerce')
-
-# Create a new column 'announcement_year' with the year extracted from 'announcement_date'
-data_subset['announcement_year'] = data_subset['announcement_date'].dt.year
-
-# Add a new column 'price_per_ton_USD'
-data_subset['price_per_ton_USD'] = data_subset['price_usd'] / data_subset['tons_purchased']
-
-#drop rows without price
-data_subset_cleaned = data_subset.dropna(subset=['price_per_ton_USD'])
-
-# change rows where 'price_per_ton_USD' is infinite
-data_subset_cleaned = data_subset_cleaned[~np.isinf(data_subset_cleaned['price_per_ton_USD'])]
-
-# Define the conversion rate from USD to EUR
-conversion_rate = 1.0718
-
-#convert to EUR
-# Add a new column 'price_per_ton_EUR'
-data_subset_cleaned['price_per_ton_EUR'] = data_subset_cleaned['price_per_ton_USD'] / conversion_rate
-
-# Show the min, max, average, mode, and median prices for each year, including data points per year
-# Group by 'announcement_year' and calculate the required statistics
-stats = data_subset_cleaned.groupby('announcement_year').agg(
-    min_price_EUR=('price_per_ton_EUR', 'min'),
-    max_price_EUR=('price_per_ton_EUR', 'max'),
-    avg_price_EUR=('price_per_ton_EUR', 'mean'),
-    median_price_EUR=('price_per_ton_EUR', 'median'),  # Get median
-    mode_price_EUR=('price_per_ton_EUR', lambda x: x.mode()[0] if not x.mode().empty else None),  # Get mode
-    count=('price_per_ton_EUR', 'count'),  # Count of non-null price_usd entries
-).reset_index()
-
-# Compute total_entries from data_subset (before filtering out missing price values)
-total_entries = data_subset.groupby('announcement_year').size().reset_index(name='total_entries')
-
-# Merge the total_entries into stats
-stats = stats.merge(total_entries, on='announcement_year', how='left')
-
-# Round the statistics to one decimal place
-stats[['min_price_EUR', 'max_price_EUR', 'avg_price_EUR', 'median_price_EUR', 'mode_price_EUR']] = \
-    stats[['min_price_EUR', 'max_price_EUR', 'avg_price_EUR', 'median_price_EUR', 'mode_price_EUR']].round(1)
-
-# Rename columns to the specified headers
-stats.rename(columns={
-    'announcement_year' : 'Year',
-    'min_price_EUR': 'Min (€)/ton CDR',
-    'max_price_EUR': 'Max (€)/ton CDR',
-    'avg_price_EUR': 'Average (€)/ton CDR',
-    'median_price_EUR': 'Median (€)/ton CDR',
-    'mode_price_EUR': 'Mode (€)/ton CDR',
-    'count': 'Transactions with price tag per year',
-    'total_entries': 'Total transactions per year',
-    'transaction_price_public': 'Share of public prices'
-}, inplace=True)
+from excelExport import SIDE_FORMATS, write_workbook
+from groupStats import grouped_stats
+from prep import exit_on_load_error, prepare
+from store import store_dir, store_stats
+from streamingStats import streaming_stats
+from timeIndex import transactions_between
 
-print(stats)
+# Workbook the results are exported to
+OUTPUT_FILENAME = 'carla_cdr_data_.xlsx'
 
-#show the min, max, average, mode prices for total dataset (2021-2024)
-stats_total = pd.DataFrame({
-    'min_price_EUR': [data_subset_cleaned['price_per_ton_EUR'].min()],
-    'max_price_EUR': [data_subset_cleaned['price_per_ton_EUR'].max()],
-    'avg_price_EUR': [data_subset_cleaned['price_per_ton_EUR'].mean()],
-    'median_price_EUR': [data_subset_cleaned['price_per_ton_EUR'].median()],
-    'mode_price_EUR': [data_subset_cleaned['price_per_ton_EUR'].mode()[0] if not data_subset_cleaned['price_per_ton_EUR'].mode().empty else None],
-    'count': [data_subset_cleaned['price_per_ton_EUR'].count()],  # Count of non-null entries
-    'total_entries': [data_subset.shape[0]]  # Total number of entries in the dataset
-})
-
-# Round the statistics to one decimal place
-stats_total[['min_price_EUR', 'max_price_EUR', 'avg_price_EUR', 'median_price_EUR', 'mode_price_EUR']] = stats_total[['min_price_EUR', 'max_price_EUR', 'avg_price_EUR', 'median_price_EUR', 'mode_price_EUR']].round(1)
-
-# Rename columns to the specified headers
-stats_total.rename(columns={
-    'announcement_year' : 'Year',
-    'min_price_EUR': 'Min (€)/ton CDR',
-    'max_price_EUR': 'Max (€)/ton CDR',
-    'avg_price_EUR': 'Average (€)/ton CDR',
-    'median_price_EUR': 'Median (€)/ton CDR',
-    'mode_price_EUR': 'Mode (€)/ton CDR',
-    'count': 'Transactions with price tag per year',
-    'total_entries': 'Total transactions per year',
-    'transaction_price_public': 'Share of public prices'
-}, inplace=True)
-
-
-print(stats_total)
-
-# Export the data_subset to an Excel file
-output_filename = 'carla_cdr_data_.xlsx'
-
-# Export the data_subset and stats to separate sheets in the same Excel file
-
-with pd.ExcelWriter(output_filename, engine='openpyxl') as writer:
-    data_subset_cleaned.to_excel(writer, sheet_name='Data Subset', index=False)
-    stats.to_excel(writer, sheet_name='Statistics per year', index=False)
-    stats_total.to_excel(writer, sheet_name='Stats total', index=False)
-
-print(f"Data subset and statistics have been successfully exported to '{output_filename}'.")
-
-# Print the current working directory
-print("the file can be found here:", os.getcwd())
-
-
-print(data_subset_cleaned[data_subset_cleaned['announcement_year'] == 2023]['price_per_ton_EUR'])
+# Define the filename
+filename = 'Thesis files/CDR_data_Oct_17_2024.csv'
 
 
+# Unrounded per-year and total price statistics of the prepared frames
+def compute_stats(data_subset, data_subset_cleaned):
+    # Show the min, max, average, mode, and median prices for each year, including data points per year
+    # Group by 'announcement_year' and calculate the required statistics in one sorted pass
+    stats = grouped_stats(
+        data_subset_cleaned, 'announcement_year', 'price_per_ton_EUR',
+        ['min', 'max', 'mean', 'median', 'mode', 'count']  # count of non-null price entries
+    ).rename(columns={
+        'min': 'min_price_EUR',
+        'max': 'max_price_EUR',
+        'mean': 'avg_price_EUR',
+        'median': 'median_price_EUR',
+        'mode': 'mode_price_EUR',
+    }).reset_index()
+
+    # Compute total_entries from data_subset (before filtering out missing price values)
+    total_entries = data_subset.groupby('announcement_year').size().reset_index(name='total_entries')
+
+    # Merge the total_entries into stats
+    stats = stats.merge(total_entries, on='announcement_year', how='left')
+
+    #show the min, max, average, mode prices for total dataset (2021-2024)
+    stats_total = pd.DataFrame({
+        'min_price_EUR': [data_subset_cleaned['price_per_ton_EUR'].min()],
+        'max_price_EUR': [data_subset_cleaned['price_per_ton_EUR'].max()],
+        'avg_price_EUR': [data_subset_cleaned['price_per_ton_EUR'].mean()],
+        'median_price_EUR': [data_subset_cleaned['price_per_ton_EUR'].median()],
+        'mode_price_EUR': [data_subset_cleaned['price_per_ton_EUR'].mode()[0] if not data_subset_cleaned['price_per_ton_EUR'].mode().empty else None],
+        'count': [data_subset_cleaned['price_per_ton_EUR'].count()],  # Count of non-null entries
+        'total_entries': [data_subset.shape[0]]  # Total number of entries in the dataset
+    })
+
+    return stats, stats_total
+
+
+# Round, rename, print and export the statistics; the raw 'Data Subset' sheet is only written when the
+# cleaned frame is given, and with side_outputs also as a file next to the workbook (see
+# excelExport.SIDE_FORMATS). Returns the exported tables.
+def report(stats, stats_total, data_subset_cleaned=None, side_outputs=False):
+    # Round the statistics to one decimal place
+    stats[['min_price_EUR', 'max_price_EUR', 'avg_price_EUR', 'median_price_EUR', 'mode_price_EUR']] = \
+        stats[['min_price_EUR', 'max_price_EUR', 'avg_price_EUR', 'median_price_EUR', 'mode_price_EUR']].round(1)
+
+    # Rename columns to the specified headers
+    stats.rename(columns={
+        'announcement_year' : 'Year',
+        'min_price_EUR': 'Min (€)/ton CDR',
+        'max_price_EUR': 'Max (€)/ton CDR',
+        'avg_price_EUR': 'Average (€)/ton CDR',
+        'median_price_EUR': 'Median (€)/ton CDR',
+        'mode_price_EUR': 'Mode (€)/ton CDR',
+        'count': 'Transactions with price tag per year',
+        'total_entries': 'Total transactions per year',
+        'transaction_price_public': 'Share of public prices'
+    }, inplace=True)
+
+    print(stats)
+
+    # Round the statistics to one decimal place
+    stats_total[['min_price_EUR', 'max_price_EUR', 'avg_price_EUR', 'median_price_EUR', 'mode_price_EUR']] = stats_total[['min_price_EUR', 'max_price_EUR', 'avg_price_EUR', 'median_price_EUR', 'mode_price_EUR']].round(1)
+
+    # Rename columns to the specified headers
+    stats_total.rename(columns={
+        'announcement_year' : 'Year',
+        'min_price_EUR': 'Min (€)/ton CDR',
+        'max_price_EUR': 'Max (€)/ton CDR',
+        'avg_price_EUR': 'Average (€)/ton CDR',
+        'median_price_EUR': 'Median (€)/ton CDR',
+        'mode_price_EUR': 'Mode (€)/ton CDR',
+        'count': 'Transactions with price tag per year',
+        'total_entries': 'Total transactions per year',
+        'transaction_price_public': 'Share of public prices'
+    }, inplace=True)
+
+
+    print(stats_total)
+
+    # Export the data_subset to an Excel file
+
+    # Export the data_subset and stats to separate sheets in the same Excel file
+
+    sheets = {} if data_subset_cleaned is None else {'Data Subset': data_subset_cleaned}
+    sheets.update({'Statistics per year': stats, 'Stats total': stats_total})
+    write_workbook(OUTPUT_FILENAME, sheets, raw=['Data Subset'] if data_subset_cleaned is not None else [],
+                   side_formats=SIDE_FORMATS if side_outputs else ())
+
+    print(f"Data subset and statistics have been successfully exported to '{OUTPUT_FILENAME}'.")
+
+    # Print the current working directory
+    print("the file can be found here:", os.getcwd())
+
+    if data_subset_cleaned is not None:
+        # The prepared rows are sorted by date, so the 2023 transactions are one slice
+        print(transactions_between(data_subset_cleaned, '2023-01-01', '2024-01-01')['price_per_ton_EUR'])
+
+    return stats, stats_total
+
+
+def analyze(data_subset, data_subset_cleaned, side_outputs=False):
+    stats, stats_total = compute_stats(data_subset, data_subset_cleaned)
+    return report(stats, stats_total, data_subset_cleaned, side_outputs=side_outputs)
+
+
+if __name__ == '__main__':
+    # Run with --streaming to build the statistics from CSV chunks, in memory that grows with the number of
+    # distinct prices rather than rows (for exports that do not fit in RAM; the raw 'Data Subset' sheet is
+    # skipped in that mode)
+    streaming = '--streaming' in sys.argv
+
+    # Run with --as-of YYYY-MM-DD to reproduce the numbers of the snapshot ingested (store.py) for that date
+    # (or --as-of N for the snapshot ingested as version N)
+    as_of = sys.argv[sys.argv.index('--as-of') + 1] if '--as-of' in sys.argv else None
+
+    # Run with --side-outputs to also write the 'Data Subset' sheet as a Parquet (or CSV) file
+    side_outputs = '--side-outputs' in sys.argv
+
+    if streaming:
+        if as_of is None:
+            # Merge exact per-chunk partial aggregates instead of grouping the full frame
+            stats, stats_total = streaming_stats(filename)
+        else:
+            # Sum the stored per-version aggregate deltas up to that snapshot
+            stats, stats_total = store_stats(store_dir(filename), as_of=as_of)
+        print("Data streamed successfully!")
+        report(stats, stats_total)
+    else:
+        with exit_on_load_error():
+            data_subset, data_subset_cleaned = prepare(filename, as_of=as_of)
+        analyze(data_subset, data_subset_cleaned, side_outputs=side_outputs)
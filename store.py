@@ -0,0 +1,373 @@
+import datetime
+import json
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+from currency import to_eur
+from loader import (BCR_METHOD, CACHE_FORMAT, COLUMNS_TO_KEEP, DTYPES, FILENAME, cache_dir, cache_lock,
+                    decode_categories, encode_categories, load_data, load_dictionary, save_dictionary,
+                    snapshot_hash)
+from streamingStats import clean_chunk, partials_from_histogram, stats_per_year, stats_total
+
+# Incremental, versioned store of CDR snapshots. Every ingestion diffs a new export against the rows currently
+# in the store and records only the difference as a new version:
+# - segment-<version>: the inserted and updated rows (entity columns as dictionary codes)
+# - deleted-<version>: (segment, row_key) of every row the version removes (deleted, or replaced by an update)
+# - aggregates-<version>: the change of the aggregates below made by the version
+# - live: row_key, content_hash and segment of every row currently in the store
+# - aggregates: USD price histogram per (method, year, date) and transaction counts per (method, year),
+#   kept up to date by adding the partials of new rows and subtracting those of removed rows (undated rows
+#   are stored under year -1); the prices are converted to EUR only when the stats are asked for, so the
+#   aggregates of versions ingested under different FX tables still add up
+# Replaying the deltas of versions 1..v reproduces snapshot v exactly, so every ingested export can be
+# analysed "as of" its date without keeping a full copy of it.
+# What is incremental is the store: the files written and the aggregates updated take time in proportion to
+# the change. Telling what changed is not: a new export is parsed (into the columnar cache, see loader.py)
+# and its rows hashed in full, in proportion to its size. Only an unchanged export is skipped outright.
+STORE_DIRNAME = 'store'
+STATE_NAME = 'state.json'
+
+# Bumped whenever the layout of the aggregates changes; a store written with another one has them rebuilt
+# from its segments on the next ingestion or query
+AGGREGATES_VERSION = 2
+
+# A transaction is identified by these columns (plus its occurrence number among identical keys)
+KEY_COLUMNS = ['purchaser_name', 'supplier_name', 'announcement_date', 'tons_purchased', 'price_usd']
+
+
+def store_dir(filename=FILENAME):
+    return os.path.join(cache_dir(filename), STORE_DIRNAME)
+
+
+# Snapshot date from names like 'CDR_data_Oct_17_2024.csv' (None if the name carries no date)
+def snapshot_date(filename):
+    match = re.search(r'(\w{3}_\d{1,2}_\d{4})', os.path.basename(filename))
+    if match is None:
+        return None
+    try:
+        return datetime.datetime.strptime(match.group(1), '%b_%d_%Y').date()
+    except ValueError:
+        return None
+
+
+def _path(directory, name):
+    return os.path.join(directory, f'{name}.{CACHE_FORMAT}')
+
+
+def _write_frame(frame, path):
+    temporary = f"{path}.{os.getpid()}.tmp"
+    if CACHE_FORMAT == 'parquet':
+        frame.to_parquet(temporary, index=False)
+    else:
+        frame.to_pickle(temporary)
+    os.replace(temporary, path)
+
+
+def _read_frame(path, columns=None, filters=None):
+    if CACHE_FORMAT == 'parquet':
+        return pd.read_parquet(path, columns=columns, filters=filters)
+    frame = pd.read_pickle(path)
+    if filters is not None:
+        for column, _, values in filters:
+            frame = frame[frame[column].isin(values)]
+    return frame if columns is None else frame[columns]
+
+
+def read_state(directory):
+    try:
+        with open(os.path.join(directory, STATE_NAME)) as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return {'versions': [], 'aggregates_version': AGGREGATES_VERSION}
+
+
+def _write_state(directory, state):
+    path = os.path.join(directory, STATE_NAME)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as handle:
+        json.dump(state, handle, indent=2)
+    os.replace(temporary, path)
+
+
+# Stable 64-bit key per row: hash of the key columns, made unique by the occurrence number of that hash.
+# Hashes are stored as int64 (same bits) because Parquet filters cannot take unsigned 64-bit values.
+def row_keys(frame):
+    key_hash = pd.util.hash_pandas_object(frame[KEY_COLUMNS], index=False).to_numpy()
+    occurrence = pd.Series(key_hash).groupby(key_hash).cumcount().to_numpy()
+    pairs = pd.DataFrame({'key': key_hash, 'occurrence': occurrence})
+    return pd.util.hash_pandas_object(pairs, index=False).to_numpy().view('int64')
+
+
+def content_hashes(frame):
+    return pd.util.hash_pandas_object(frame[COLUMNS_TO_KEEP], index=False).to_numpy().view('int64')
+
+
+# Price histogram per (method, year, announcement date, USD price) and transaction count per (method, year).
+# The prices stay in USD next to their date, so the histogram does not depend on the FX table (see
+# eur_histogram). Keys are plain values (method names, integer years with -1 for undated rows, dates as
+# int64 nanoseconds with NaT's value for undated rows) so partials of any two frames align.
+def row_partials(frame):
+    frame, cleaned = clean_chunk(frame)
+    for part in (frame, cleaned):
+        part['method'] = part['method'].astype(object)
+        part['announcement_year'] = part['announcement_year'].fillna(-1).astype('int64')
+    cleaned['announcement_day'] = cleaned['announcement_date'].to_numpy(dtype='datetime64[ns]').view('int64')
+    histogram = cleaned.groupby(['method', 'announcement_year', 'announcement_day', 'price_per_ton_USD']).size()
+    totals = frame.groupby(['method', 'announcement_year']).size()
+    return histogram, totals
+
+
+# The histogram of one method as (year, EUR price) counts, its USD prices converted at the rates of their
+# dates (rates: a table from currency.load_rates, the local one by default) exactly as prep.clean_prices does
+def eur_histogram(histogram, rates=None):
+    dates = pd.Series(histogram.index.get_level_values(1).to_numpy(dtype='int64').view('datetime64[ns]'))
+    usd = pd.Series(histogram.index.get_level_values(2).to_numpy(dtype='float64'))
+    eur = to_eur(usd, dates, rates).to_numpy()
+    index = pd.MultiIndex.from_arrays([histogram.index.get_level_values(0), eur])
+    return pd.Series(histogram.to_numpy(), index=index).groupby(level=[0, 1]).sum()
+
+
+def _undated_as_nan(series):
+    levels = [series.index.get_level_values(level) for level in range(series.index.nlevels)]
+    years = levels[0].to_numpy(dtype='float64')
+    years[years == -1] = np.nan
+    levels[0] = pd.Index(years, name='announcement_year')
+    return pd.Series(series.to_numpy(), index=pd.MultiIndex.from_arrays(levels) if len(levels) > 1 else levels[0])
+
+
+def _combine(left, right, sign):
+    if right.empty:
+        return left
+    if left.empty:
+        return sign * right
+    combined = left.add(sign * right, fill_value=0)
+    return combined[combined != 0].astype('int64')
+
+
+def empty_aggregates():
+    return pd.Series(dtype='int64'), pd.Series(dtype='int64')
+
+
+def read_aggregates(directory, name='aggregates'):
+    path = os.path.join(directory, f'{name}.pkl')
+    if not os.path.exists(path):
+        return empty_aggregates()
+    return pd.read_pickle(path)
+
+
+# The partials a version changed the aggregates by: those of the rows it added minus those it removed
+def _delta_partials(directory, added, removed):
+    added_histogram, added_totals = row_partials(added)
+    removed_histogram, removed_totals = row_partials(read_rows(directory, removed[['segment', 'row_key']]))
+    return _combine(added_histogram, removed_histogram, -1), _combine(added_totals, removed_totals, -1)
+
+
+# Bring the aggregates of a store written with another AGGREGATES_VERSION to the current layout: the delta
+# of every version again from its segment and its deleted rows, and their sum
+def _upgrade_aggregates(directory, state):
+    if state.get('aggregates_version') == AGGREGATES_VERSION:
+        return state
+    histogram, totals = empty_aggregates()
+    dictionary = load_dictionary(os.path.dirname(directory))
+    for v in range(1, len(state['versions']) + 1):
+        added = decode_categories(_read_frame(_path(directory, f'segment-{v}')), dictionary).drop(columns='row_key')
+        delta_histogram, delta_totals = _delta_partials(directory, added, _read_frame(_path(directory, f'deleted-{v}')))
+        _write_aggregates(directory, (delta_histogram, delta_totals), name=f'aggregates-{v}')
+        histogram = _combine(histogram, delta_histogram, 1)
+        totals = _combine(totals, delta_totals, 1)
+    _write_aggregates(directory, (histogram, totals))
+    state = {**state, 'aggregates_version': AGGREGATES_VERSION}
+    _write_state(directory, state)
+    return state
+
+
+def _write_aggregates(directory, aggregates, name='aggregates'):
+    path = os.path.join(directory, f'{name}.pkl')
+    temporary = f"{path}.{os.getpid()}.tmp"
+    pd.to_pickle(aggregates, temporary)
+    os.replace(temporary, path)
+
+
+def read_live(directory):
+    path = _path(directory, 'live')
+    if not os.path.exists(path):
+        return pd.DataFrame({
+            'row_key': pd.Series(dtype='int64'),
+            'content_hash': pd.Series(dtype='int64'),
+            'segment': pd.Series(dtype='int64'),
+        })
+    return _read_frame(path)
+
+
+# Read the given rows (by segment and row_key) back from their segments, entity columns decoded
+def read_rows(directory, rows, columns=None):
+    dictionary = load_dictionary(os.path.dirname(directory))
+    frames = [
+        _read_frame(_path(directory, f'segment-{segment}'), filters=[('row_key', 'in', keys.tolist())])
+        for segment, keys in rows.groupby('segment')['row_key']
+    ]
+    if not frames:
+        empty = pd.DataFrame(columns=COLUMNS_TO_KEEP).astype(DTYPES)
+        empty.insert(0, 'row_key', pd.Series(dtype='int64'))
+        frames = [encode_categories(empty, dictionary)]
+    frame = pd.concat(frames, ignore_index=True)
+    if columns is not None:
+        frame = frame[['row_key', *columns]]
+    return decode_categories(frame, dictionary)
+
+
+# Diff a new export against the store and apply only the inserts, updates and deletes. An export whose
+# size and modification time match its columnar cache is not even hashed (see loader.snapshot_hash), and
+# one with the content of the latest version is not read; any other is loaded and keyed row by row.
+def ingest_snapshot(filename, directory=None):
+    directory = directory or store_dir(filename)
+    os.makedirs(directory, exist_ok=True)
+    state = _upgrade_aggregates(directory, read_state(directory))
+    sha256 = snapshot_hash(filename)
+    if state['versions'] and state['versions'][-1]['sha256'] == sha256:
+        return state['versions'][-1]
+
+    new = load_data(filename)
+    new_keys, new_hashes = row_keys(new), content_hashes(new)
+    live = read_live(directory)
+
+    # Classify every row by looking its key up in the live index
+    live_by_key = pd.Series(live['content_hash'].to_numpy(), index=live['row_key'].to_numpy())
+    known = np.isin(new_keys, live_by_key.index)
+    old_hashes = live_by_key.reindex(new_keys[known]).to_numpy()
+    changed = np.zeros(len(new), dtype=bool)
+    changed[np.flatnonzero(known)[old_hashes != new_hashes[known]]] = True
+    inserted = ~known
+    gone = ~np.isin(live['row_key'].to_numpy(), new_keys)
+    replaced = live['row_key'].isin(new_keys[changed]).to_numpy()
+    removed = live[gone | replaced]
+
+    version = len(state['versions']) + 1
+
+    # Only the added rows are written; the removed ones are read back to update the aggregates
+    added = new[inserted | changed].copy()
+    added_keys, added_hashes = new_keys[inserted | changed], new_hashes[inserted | changed]
+    delta_histogram, delta_totals = _delta_partials(directory, added, removed)
+    histogram, totals = read_aggregates(directory)
+    histogram = _combine(histogram, delta_histogram, 1)
+    totals = _combine(totals, delta_totals, 1)
+
+    # The dictionary is shared with the columnar caches of the folder
+    with cache_lock(os.path.dirname(directory)):
+        dictionary = load_dictionary(os.path.dirname(directory))
+        segment = encode_categories(added, dictionary)
+        save_dictionary(os.path.dirname(directory), dictionary)
+    segment.insert(0, 'row_key', added_keys)
+    _write_frame(segment.reset_index(drop=True), _path(directory, f'segment-{version}'))
+    _write_frame(removed[['segment', 'row_key']].reset_index(drop=True), _path(directory, f'deleted-{version}'))
+
+    live = pd.concat([
+        live[~(gone | replaced)],
+        pd.DataFrame({'row_key': added_keys, 'content_hash': added_hashes, 'segment': version}),
+    ], ignore_index=True)
+    _write_frame(live, _path(directory, 'live'))
+    _write_aggregates(directory, (delta_histogram, delta_totals), name=f'aggregates-{version}')
+    _write_aggregates(directory, (histogram, totals))
+
+    date = snapshot_date(filename)
+    record = {
+        'version': version,
+        'snapshot': os.path.basename(filename),
+        'snapshot_date': date.isoformat() if date else None,
+        'sha256': sha256,
+        'inserted': int(inserted.sum()),
+        'updated': int(changed.sum()),
+        'deleted': int(gone.sum()),
+        'rows': len(live),
+    }
+    state['versions'].append(record)
+    _write_state(directory, state)
+    return record
+
+
+# Version to use for an "as of" query: a version number, or the latest snapshot dated on or before a date.
+# The command lines pass it as text: a string of digits only is a version number ('3'), anything else a date.
+def resolve_version(directory, as_of):
+    versions = read_state(directory)['versions']
+    if isinstance(as_of, str) and as_of.strip().isdigit():
+        as_of = int(as_of)
+    if isinstance(as_of, (int, np.integer)):
+        if not 1 <= as_of <= len(versions):
+            raise ValueError(f"Version {as_of} does not exist (the store has {len(versions)} versions).")
+        return as_of
+    date = pd.Timestamp(as_of).date().isoformat()
+    dated = [record for record in versions if record['snapshot_date'] and record['snapshot_date'] <= date]
+    if not dated:
+        raise ValueError(f"No snapshot dated on or before {date} has been ingested.")
+    return max(dated, key=lambda record: (record['snapshot_date'], record['version']))['version']
+
+
+# (segment, row_key) of every row of the store at a given version: the rows added by versions 1..v
+# minus the rows those versions removed
+def rows_at(directory, version):
+    added = pd.concat([
+        _read_frame(_path(directory, f'segment-{v}'), columns=['row_key']).assign(segment=v)
+        for v in range(1, version + 1)
+    ], ignore_index=True)
+    removed = pd.concat([_read_frame(_path(directory, f'deleted-{v}')) for v in range(1, version + 1)])
+    removed = pd.MultiIndex.from_frame(removed[['segment', 'row_key']])
+    keep = ~pd.MultiIndex.from_frame(added[['segment', 'row_key']]).isin(removed)
+    return added.loc[keep, ['segment', 'row_key']]
+
+
+def _select(directory, rows, method, columns):
+    frame = read_rows(directory, rows, columns=None if columns is None else list(dict.fromkeys([*columns, 'method'])))
+    if method is not None:
+        frame = frame[frame['method'] == method]
+    return frame[list(columns or COLUMNS_TO_KEEP)].reset_index(drop=True)
+
+
+# Current transactions of the store (one method, or all with method=None)
+def load_current(directory, method=BCR_METHOD, columns=None):
+    return _select(directory, read_live(directory)[['segment', 'row_key']], method, columns)
+
+
+# Transactions as they were in the snapshot ingested for a date (or a version number)
+def load_as_of(directory, as_of, method=BCR_METHOD, columns=None):
+    return _select(directory, rows_at(directory, resolve_version(directory, as_of)), method, columns)
+
+
+# Aggregates as they were at a version, summed from the per-version deltas
+def aggregates_at(directory, version):
+    histogram, totals = empty_aggregates()
+    for v in range(1, version + 1):
+        delta_histogram, delta_totals = read_aggregates(directory, name=f'aggregates-{v}')
+        histogram = _combine(histogram, delta_histogram, 1)
+        totals = _combine(totals, delta_totals, 1)
+    return histogram, totals
+
+
+# Unrounded "Statistics per year" and "Stats total" tables, answered from the maintained aggregates
+# (the current ones, or those of the snapshot ingested for a date when as_of is given), the prices converted
+# at the current rates (or those of rates)
+def store_stats(directory, method=BCR_METHOD, as_of=None, rates=None):
+    _upgrade_aggregates(directory, read_state(directory))
+    if as_of is None:
+        histogram, totals = read_aggregates(directory)
+    else:
+        histogram, totals = aggregates_at(directory, resolve_version(directory, as_of))
+    histogram = histogram[histogram.index.get_level_values(0) == method].droplevel(0)
+    totals = totals[totals.index.get_level_values(0) == method].droplevel(0)
+    partials = partials_from_histogram(_undated_as_nan(eur_histogram(histogram, rates)), _undated_as_nan(totals))
+    return stats_per_year(partials), stats_total(partials, int(totals.sum()))
+
+
+# Usage: python store.py 'Thesis files/CDR_data_<date>.csv'
+if __name__ == '__main__':
+    snapshot = sys.argv[1] if len(sys.argv) > 1 else FILENAME
+    record = ingest_snapshot(snapshot)
+    print(f"Ingested '{record['snapshot']}' as version {record['version']}: "
+          f"{record['inserted']} inserted, {record['updated']} updated, {record['deleted']} deleted, "
+          f"{record['rows']} rows in the store.")
+    stats, total = store_stats(store_dir(snapshot))
+    print(stats)
+    print(total)
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+
+from loader import BCR_METHOD, CHUNKSIZE, DTYPES, FILENAME, iter_transactions
+from prep import clean_prices, derive_prices
+
+# Only these columns are needed to build the yearly price statistics
+STREAM_COLUMNS = ["tons_purchased", "price_usd", "announcement_date"]
+
+
+# Apply the shared preparation (prep.py) to one chunk: year, price per ton, drop missing/infinite prices, EUR
+def clean_chunk(chunk):
+    chunk = derive_prices(chunk.copy())
+    return chunk, clean_prices(chunk)
+
+
+# Partial aggregates of one chunk, all of them exactly mergeable:
+# - moments: count, sum, min and max of the EUR price per year
+# - histogram: number of occurrences of every distinct price per year (gives exact median and mode)
+# - totals: number of transactions per year, with or without a price
+def chunk_partials(chunk):
+    chunk, cleaned = clean_chunk(chunk)
+    # Undated rows are kept under a NaN year: they are part of the totals, not of any year
+    prices = cleaned.groupby('announcement_year', dropna=False)['price_per_ton_EUR']
+    moments = prices.agg(['count', 'sum', 'min', 'max'])
+    histogram = cleaned.groupby(['announcement_year', 'price_per_ton_EUR'], dropna=False).size()
+    totals = chunk.groupby('announcement_year').size()
+    return moments, histogram, totals
+
+
+def merge_partials(left, right):
+    if left is None:
+        return right
+    moments = pd.concat([left[0], right[0]]).groupby(level=0, dropna=False).agg(
+        {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'}
+    )
+    histogram = pd.concat([left[1], right[1]]).groupby(level=[0, 1], dropna=False).sum()
+    totals = pd.concat([left[2], right[2]]).groupby(level=0).sum()
+    return moments, histogram, totals
+
+
+# Exact median and mode per key from a (key, value) -> count histogram.
+# The median averages the two middle values like pandas; ties for the mode go to the smallest value.
+def histogram_median_mode(histogram):
+    histogram = histogram.sort_index()
+    keys = histogram.index.get_level_values(0)
+    values = histogram.index.get_level_values(1).to_numpy(dtype='float64')
+    counts = histogram.to_numpy()
+
+    cumulative = histogram.groupby(level=0).cumsum().to_numpy()
+    n = histogram.groupby(level=0).transform('sum').to_numpy()
+    lower_rank = (n - 1) // 2
+    upper_rank = n // 2
+    lower = (cumulative - counts <= lower_rank) & (cumulative > lower_rank)
+    upper = (cumulative - counts <= upper_rank) & (cumulative > upper_rank)
+    median = (pd.Series(values[lower], index=keys[lower]) + pd.Series(values[upper], index=keys[upper])) / 2
+
+    mode_index = histogram.groupby(level=0).idxmax()
+    mode = pd.Series([index[1] for index in mode_index], index=mode_index.index)
+    return median, mode
+
+
+# Rebuild the (moments, histogram, totals) partials from a (year, price) -> count histogram alone.
+# Counts can be added and subtracted, so this is what incrementally maintained aggregates keep.
+def partials_from_histogram(histogram, totals):
+    histogram = histogram[histogram > 0]
+    totals = totals[totals > 0]
+    counts = histogram.to_numpy()
+    values = histogram.index.get_level_values(1).to_numpy(dtype='float64')
+    per_value = pd.DataFrame(
+        {'count': counts, 'sum': values * counts, 'min': values, 'max': values},
+        index=histogram.index.get_level_values(0),
+    )
+    moments = per_value.groupby(level=0, dropna=False).agg({'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'})
+    return moments, histogram, totals
+
+
+# Build the unrounded "Statistics per year" table (same columns as the in-memory path of stats.py)
+def stats_per_year(partials):
+    moments, histogram, totals = partials
+    moments = moments[moments.index.notna()]
+    histogram = histogram[histogram.index.get_level_values(0).notna()]
+    median, mode = histogram_median_mode(histogram)
+    stats = pd.DataFrame({
+        'min_price_EUR': moments['min'],
+        'max_price_EUR': moments['max'],
+        'avg_price_EUR': moments['sum'] / moments['count'],
+        'median_price_EUR': median,
+        'mode_price_EUR': mode,
+        'count': moments['count'],
+    })
+    stats.index.name = 'announcement_year'
+    stats = stats.reset_index()
+    total_entries = totals.rename('total_entries').reset_index()
+    return stats.merge(total_entries, on='announcement_year', how='left')
+
+
+# Build the unrounded "Stats total" table by collapsing the yearly partials (undated rows included)
+# into a single key
+def stats_total(partials, total_entries):
+    moments, histogram, totals = partials
+    overall = histogram.groupby(level=1).sum()
+    overall.index = pd.MultiIndex.from_arrays([np.zeros(len(overall), dtype=int), overall.index])
+    median, mode = histogram_median_mode(overall)
+    count = moments['count'].sum()
+    return pd.DataFrame({
+        'min_price_EUR': [moments['min'].min()],
+        'max_price_EUR': [moments['max'].max()],
+        'avg_price_EUR': [moments['sum'].sum() / count if count else np.nan],
+        'median_price_EUR': [median.iloc[0] if len(median) else np.nan],
+        'mode_price_EUR': [mode.iloc[0] if len(mode) else None],
+        'count': [count],
+        'total_entries': [total_entries],
+    })
+
+
+# Stream the CSV chunk by chunk and return the unrounded per-year and total statistics; an export without
+# rows of the method gives an empty per-year table and a total row without prices.
+# Memory does not grow with the number of rows, but it is not bounded by a constant either: the median and
+# the mode are kept exact, which takes one count per distinct (year, price) pair, so memory grows with the
+# number of distinct prices (at most the number of priced rows). Mergeable sketches would bound it (see
+# quantileSketch.py for KLL quantiles) but give approximate medians and no mode, so they are not used here.
+def streaming_stats(filename=FILENAME, method=BCR_METHOD, chunksize=CHUNKSIZE):
+    partials = None
+    total_entries = 0
+    for chunk in iter_transactions(filename, method=method, columns=STREAM_COLUMNS, chunksize=chunksize):
+        total_entries += len(chunk)
+        partials = merge_partials(partials, chunk_partials(chunk))
+    if partials is None:
+        partials = chunk_partials(pd.DataFrame({column: pd.Series(dtype=DTYPES[column]) for column in STREAM_COLUMNS}))
+    return stats_per_year(partials), stats_total(partials, total_entries)
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules live flat at the top of the repository and are imported by name, as the scripts do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Figures are rendered headless
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+
+# A synthetic CDR export of n transactions: random buyers, suppliers, marketplaces and methods (about half
+# of them BCR), announced between 2021 and 2024, a few without a price
+def make_transactions(n, seed=0):
+    rng = np.random.default_rng(seed)
+    tons = rng.integers(1, 5000, n).astype('float64')
+    price = tons * rng.uniform(50, 800, n)
+    price[rng.random(n) < 0.1] = np.nan
+    dates = pd.Timestamp('2021-01-01') + pd.to_timedelta(rng.integers(0, 4 * 365, n), unit='D')
+    return pd.DataFrame({
+        'id': np.arange(n) + seed * 100_000,
+        'purchaser_name': [f"Buyer {i}" for i in rng.integers(0, 40, n)],
+        'supplier_name': [f"Supplier {i}" for i in rng.integers(0, 20, n)],
+        'marketplace_name': rng.choice(['CDR.fyi', 'Puro', None], n),
+        'status': rng.choice(['Contracted', 'Delivered'], n),
+        'method': rng.choice(['Biochar Carbon Removal (BCR)', 'Direct Air Capture (DAC)'], n),
+        'tons_purchased': tons,
+        'price_usd': price.round(),
+        'announcement_date': dates.strftime('%Y-%m-%d'),
+        'delivery_date': dates.strftime('%Y-%m-%d'),
+        'tons_delivered': tons / 2,
+    })
+
+
+# Write a frame as an export (CSV) into the test's folder and return its path; the cache and the store
+# are then created next to it
+@pytest.fixture
+def write_export(tmp_path):
+    def write(frame, name='CDR_data_Oct_17_2024.csv'):
+        path = tmp_path / name
+        frame.to_csv(path, index=False)
+        return str(path)
+    return write
@@ -0,0 +1,50 @@
+from analysisDaemon import refresh
+from pipeline import Stage
+
+calls = []
+
+
+def write_table(value, path):
+    calls.append('table')
+    with open(path, 'w') as f:
+        f.write(f"value {value}\n")
+    return value
+
+
+def fail(value):
+    calls.append('fail')
+    raise ValueError("no data")
+
+
+def _stages(path):
+    return {
+        'source': Stage(int, ()),
+        'table': Stage(write_table, ('source',), {'path': path}, outputs=(path,)),
+        'broken': Stage(fail, ('source',)),
+    }
+
+
+def test_refresh_keeps_failures_and_rewrites_edited_outputs(tmp_path):
+    path = str(tmp_path / 'table.txt')
+    stages = _stages(path)
+    calls.clear()
+    results, ran = refresh(stages, {}, targets=['table', 'broken'], memo_dir=str(tmp_path / 'memo'))
+    assert results['broken'].error == "ValueError: no data"
+    assert sorted(calls) == ['fail', 'table']
+
+    # Nothing changed: neither the stage that failed nor the one that succeeded runs again
+    calls.clear()
+    results, ran = refresh(stages, results, targets=['table', 'broken'], memo_dir=str(tmp_path / 'memo'))
+    assert ran == ['source'] and calls == []
+    assert results['broken'].error == "ValueError: no data"
+
+    # An edited output is written again, also when the memo folder has the run
+    with open(path, 'w') as f:
+        f.write("edited\n")
+    for previous in (results, {}):
+        results, ran = refresh(stages, previous, targets=['table'], memo_dir=str(tmp_path / 'memo'))
+        assert 'table' in ran
+        with open(path) as f:
+            assert f.read() == "value 0\n"
+        with open(path, 'w') as f:
+            f.write("edited\n")
@@ -0,0 +1,32 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import entityIndex
+from conftest import make_transactions
+from loader import BCR_METHOD, cached_path, load_data
+
+
+def test_lookup_reads_the_rows_at_the_offsets(write_export):
+    filename = write_export(make_transactions(300, seed=5))
+    # Indexes missing (a cache written before they existed) are rebuilt on first use
+    shutil.rmtree(entityIndex.index_dir(cached_path(filename)))
+    matches = entityIndex.lookup(filename, marketplace_name='Puro', method=BCR_METHOD)
+    everything = load_data(filename)
+    expected = everything[(everything['marketplace_name'] == 'Puro') & (everything['method'] == BCR_METHOD)]
+    assert len(matches) > 0
+    pd.testing.assert_frame_equal(matches, expected)
+    assert entityIndex.lookup(filename, purchaser_name='Nobody').empty
+
+
+def test_read_rows_spans_row_groups(write_export):
+    pq = pytest.importorskip('pyarrow.parquet')
+    filename = write_export(make_transactions(300, seed=6))
+    cache_path = cached_path(filename)
+    # Same cache folder (and dictionary), several row groups
+    split = cache_path.replace('.parquet', '.split.parquet')
+    pq.write_table(pq.read_table(cache_path), split, row_group_size=70)
+    offsets = np.array([0, 69, 70, 141, 250, 299])
+    pd.testing.assert_frame_equal(entityIndex.read_rows(split, offsets), load_data(filename).take(offsets))
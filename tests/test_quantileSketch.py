@@ -0,0 +1,27 @@
+import numpy as np
+
+from quantileSketch import empty_sketch, sketch_merge, sketch_quantiles, sketch_update
+
+
+def _sketch(values, k=50):
+    return sketch_update(empty_sketch(k), values)
+
+
+def test_a_sketch_does_not_depend_on_the_sketches_built_before_it():
+    values = np.random.default_rng(1).lognormal(5, 1, 5000)
+    first = _sketch(values)
+    for other in range(3):
+        _sketch(np.random.default_rng(other).normal(size=3000))
+    again = _sketch(values)
+    assert all(np.array_equal(a, b) for a, b in zip(first.levels, again.levels))
+
+
+def test_merged_sketches_answer_within_the_rank_error():
+    values = np.random.default_rng(2).lognormal(5, 1, 20000)
+    merged = empty_sketch(200)
+    for part in np.array_split(values, 7):
+        merged = sketch_merge(merged, _sketch(part, k=200))
+    assert merged.n == len(values)
+    quantiles = np.array([0.1, 0.25, 0.5, 0.75, 0.9])
+    ranks = np.searchsorted(np.sort(values), sketch_quantiles(merged, quantiles)) / len(values)
+    assert np.all(np.abs(ranks - quantiles) < 0.02)
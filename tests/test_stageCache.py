@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+
+import pandas as pd
+
+from pipeline import Stage, run_pipeline, watch
+from stageCache import digest, forget, lookup, stage_key, store
+
+
+def write_table(value, path):
+    with open(path, 'w') as f:
+        f.write(f"value {value}\n")
+    return value
+
+
+def _stages(path):
+    return {
+        'source': Stage(int, ()),
+        'table': Stage(write_table, ('source',), {'path': path}, outputs=(path,)),
+    }
+
+
+def _run(stages, memo_dir):
+    replayed = []
+    outputs, _, errors = run_pipeline(['table'], stages=stages, memo_dir=memo_dir, render_workers=1,
+                                      replayed=replayed)
+    assert not errors
+    return replayed
+
+
+def test_digest_ignores_the_sign_of_nan():
+    values = pd.Series([1.0, float('nan')])
+    negative = values.copy()
+    negative.iloc[1] = -negative.iloc[1]
+    assert digest(values) == digest(negative)
+    assert digest(values) != digest(pd.Series([1.0, 2.0]))
+
+
+def test_lookup_misses_when_a_written_file_changed(tmp_path):
+    memo_dir, path = str(tmp_path / 'memo'), str(tmp_path / 'table.txt')
+    key = stage_key(write_table, {'path': path}, [digest(0)])
+    write_table(0, path)
+    store(memo_dir, key, 0, 'printed', (), files=[path])
+    assert lookup(memo_dir, key, [path])[0] == 0
+
+    # Touched but unchanged still counts
+    os.utime(path, ns=(0, 0))
+    assert lookup(memo_dir, key, [path]) is not None
+
+    with open(path, 'w') as f:
+        f.write("someone else's content\n")
+    assert lookup(memo_dir, key, [path]) is None
+    os.remove(path)
+    assert lookup(memo_dir, key, [path]) is None
+
+
+def test_pipeline_rewrites_an_output_replaced_since_the_memoized_run(tmp_path):
+    memo_dir, path = str(tmp_path / 'memo'), str(tmp_path / 'table.txt')
+    stages = _stages(path)
+    assert _run(stages, memo_dir) == []
+    assert _run(stages, memo_dir) == ['table']
+
+    # e.g. stats.py --streaming writing the same workbook without the raw sheet
+    with open(path, 'w') as f:
+        f.write("another version\n")
+    assert _run(stages, memo_dir) == []
+    with open(path) as f:
+        assert f.read() == "value 0\n"
+    assert _run(stages, memo_dir) == ['table']
+
+
+def test_forget_drops_the_entries_that_wrote_a_file(tmp_path):
+    memo_dir, path = str(tmp_path / 'memo'), str(tmp_path / 'table.txt')
+    write_table(0, path)
+    store(memo_dir, 'writes', 0, files=[path])
+    store(memo_dir, 'computes', 1)
+    assert forget(memo_dir, [path]) == 1
+    assert lookup(memo_dir, 'writes', [path]) is None
+    assert lookup(memo_dir, 'computes')[0] == 1
+
+
+def test_watch_rewrites_an_edited_output(tmp_path):
+    memo_dir, path = str(tmp_path / 'memo'), str(tmp_path / 'table.txt')
+    stages = _stages(path)
+    runs = []
+
+    def run(arguments):
+        runs.append(_run(stages, memo_dir))
+        if len(runs) == 2:
+            raise KeyboardInterrupt
+
+    watcher = threading.Thread(target=watch, args=([], [], [path]),
+                               kwargs={'poll_seconds': 0.02, 'memo_dir': memo_dir, 'run': run})
+    watcher.start()
+    deadline = time.monotonic() + 30
+    while not runs and time.monotonic() < deadline:
+        time.sleep(0.02)
+    # Let the watcher record the state the run left before editing
+    time.sleep(0.2)
+    with open(path, 'w') as f:
+        f.write("edited by hand\n")
+    watcher.join(30)
+
+    assert not watcher.is_alive()
+    assert runs == [[], []]
+    with open(path) as f:
+        assert f.read() == "value 0\n"
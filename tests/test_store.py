@@ -0,0 +1,43 @@
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+from conftest import make_transactions
+from pipeline import build_stages, run_pipeline
+from store import ingest_snapshot, resolve_version, store_dir
+
+
+# Two weekly exports: the second drops 20 transactions of the first and adds 50
+def _ingest_two_snapshots(write_export):
+    old = make_transactions(200, seed=1)
+    new = pd.concat([old.iloc[20:], make_transactions(50, seed=2)], ignore_index=True)
+    first = write_export(old, 'CDR_data_Oct_17_2024.csv')
+    second = write_export(new, 'CDR_data_Oct_24_2024.csv')
+    with contextlib.redirect_stdout(io.StringIO()):
+        ingest_snapshot(first)
+        ingest_snapshot(second)
+    return second
+
+
+def test_as_of_stages_see_the_same_snapshot(write_export):
+    filename = _ingest_two_snapshots(write_export)
+    for as_of, rows in (('2024-10-17', 200), ('2024-10-30', 230), (None, 230)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            outputs, _, errors = run_pipeline(['total_transactions', 'all_transactions'],
+                                              stages=build_stages(filename, as_of=as_of), render_workers=1)
+        assert not errors
+        assert outputs['total_transactions'] == len(outputs['all_transactions']) == rows
+
+
+def test_resolve_version_takes_command_line_text(write_export):
+    directory = store_dir(_ingest_two_snapshots(write_export))
+    assert resolve_version(directory, '1') == 1
+    assert resolve_version(directory, 2) == 2
+    assert resolve_version(directory, '2024-10-20') == 1
+    assert resolve_version(directory, '2024-10-24') == 2
+    with pytest.raises(ValueError, match='Version 3 does not exist'):
+        resolve_version(directory, '3')
+    with pytest.raises(ValueError, match='No snapshot'):
+        resolve_version(directory, '2024-01-01')
@@ -0,0 +1,27 @@
+import contextlib
+import io
+
+import numpy as np
+
+from conftest import make_transactions
+from prep import prepare
+from stats import compute_stats
+from streamingStats import streaming_stats
+
+
+def test_streaming_matches_the_in_memory_statistics(write_export):
+    filename = write_export(make_transactions(500, seed=3))
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = compute_stats(*prepare(filename))
+    for table, reference in zip(streaming_stats(filename, chunksize=64), expected):
+        assert list(table.columns) == list(reference.columns)
+        assert np.allclose(table.to_numpy(dtype='float64'), reference.to_numpy(dtype='float64'), equal_nan=True)
+
+
+def test_streaming_an_export_without_rows_of_the_method(write_export):
+    frame = make_transactions(100, seed=4)
+    frame['method'] = 'Direct Air Capture (DAC)'
+    stats, total = streaming_stats(write_export(frame))
+    assert stats.empty
+    assert total['count'].iloc[0] == 0
+    assert total['total_entries'].iloc[0] == 0
@@ -0,0 +1,25 @@
+import pandas as pd
+
+from timeIndex import is_sorted_by_date, sort_by_date, transactions_between
+
+
+def _frame():
+    dates = pd.to_datetime(['2023-05-01', '2021-01-10', None, '2022-07-15', '2021-06-30', '2024-02-01'])
+    return pd.DataFrame({'announcement_date': dates, 'tons': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]})
+
+
+def test_transactions_between_on_an_unsorted_frame():
+    frame = _frame()
+    assert not is_sorted_by_date(frame)
+    between = transactions_between(frame, '2021-06-01', '2023-05-01')
+    assert sorted(between['tons']) == [4.0, 5.0]
+    assert list(transactions_between(frame, start='2023-01-01')['tons']) == [1.0, 6.0]
+    assert len(transactions_between(frame)) == 5
+
+
+def test_sorted_frames_are_sliced_as_is():
+    frame = sort_by_date(_frame())
+    assert is_sorted_by_date(frame)
+    assert sort_by_date(frame) is frame
+    between = transactions_between(frame, '2021-01-01', '2022-01-01')
+    assert list(between.index) == [1, 4]
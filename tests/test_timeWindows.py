@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+from conftest import make_transactions
+from timeWindows import rolling_stats
+
+
+def test_rolling_volume_counts_unpriced_transactions():
+    frame = make_transactions(400, seed=7)
+    frame['announcement_date'] = pd.to_datetime(frame['announcement_date'])
+    frame['price_per_ton_EUR'] = frame['price_usd'] / frame['tons_purchased']
+    priced = frame.dropna(subset=['price_per_ton_EUR'])
+    with_volume = frame.dropna(subset=['tons_purchased'])
+
+    rolling = rolling_stats(priced, window='quarter', step='month', volume_frame=with_volume)
+    assert len(rolling) > 0
+    window = pd.Timedelta('91D')
+    for end, row in rolling.iterrows():
+        def inside(rows):
+            return rows[(rows['announcement_date'] > end - window) & (rows['announcement_date'] <= end)]
+        assert np.isclose(row['volume'], inside(with_volume)['tons_purchased'].sum())
+        assert row['count'] == len(inside(priced))
+        assert np.isclose(row['median'], inside(priced)['price_per_ton_EUR'].median(), equal_nan=True)
+    # Without a volume frame the volume is that of the priced rows
+    assert (rolling_stats(priced, window='quarter', step='month')['volume'] <= rolling['volume']).all()
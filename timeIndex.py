@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+# Column the prepared frames are kept sorted by
+DATE_COLUMN = 'announcement_date'
+
+
+# Whether the rows are in the order of sort_by_date: dates ascending, undated rows last
+def is_sorted_by_date(frame, date=DATE_COLUMN):
+    dated = frame[date].notna().to_numpy()
+    n_dated = int(dated.sum())
+    return bool(dated[:n_dated].all()) and frame[date].iloc[:n_dated].is_monotonic_increasing
+
+
+# Sort the rows by date, oldest first and undated rows last. The sort is stable and the index labels are
+# kept, so rows still align with anything indexed like the unsorted frame. A frame already in order is
+# returned as is.
+def sort_by_date(frame, date=DATE_COLUMN):
+    if is_sorted_by_date(frame, date):
+        return frame
+    return frame.sort_values(date, kind='stable', na_position='last')
+
+
+# Row positions [first, stop) of the dates in [start, end) of a frame sorted by sort_by_date, found by
+# binary search (NaT sorts after every date, so undated rows are never inside a range). start or end None
+# leaves that side open.
+def date_positions(frame, start=None, end=None, date=DATE_COLUMN):
+    dates = frame[date].to_numpy()
+    first = 0 if start is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(start)), side='left')
+    stop = np.searchsorted(dates, np.datetime64('NaT')) if end is None else \
+        np.searchsorted(dates, np.datetime64(pd.Timestamp(end)), side='left')
+    return int(first), int(max(first, stop))
+
+
+# The transactions announced on or after start and before end. On a frame sorted by sort_by_date (as the
+# prepared frames are) they are a slice, found by binary search, and no rows are copied (modify a .copy()
+# of it, not the slice); any other frame is sorted first.
+def transactions_between(frame, start=None, end=None, date=DATE_COLUMN):
+    frame = sort_by_date(frame, date)
+    first, stop = date_positions(frame, start, end, date)
+    return frame.iloc[first:stop]
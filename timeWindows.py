@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+# Names accepted for window and step sizes besides any pandas timedelta string ('7D', '12h', ...)
+PERIODS = {
+    'week': '7D',
+    'month': '30D',
+    'quarter': '91D',
+    'year': '365D',
+}
+
+
+def _timedelta(period):
+    return pd.Timedelta(PERIODS.get(period, period))
+
+
+# Counts per value rank in a Fenwick (binary indexed) tree: adding or removing a value and finding the
+# k-th smallest value in the window both take O(log n), whatever the size of the window. A batch of ranks
+# is added in one vectorized sweep per tree level.
+def _fenwick_add(tree, ranks, delta):
+    positions = ranks + 1
+    while len(positions):
+        np.add.at(tree, positions, delta)
+        positions = positions + (positions & -positions)
+        positions = positions[positions < len(tree)]
+
+
+# Rank (0-based) of the k-th smallest value (k counted from 1)
+def _fenwick_kth(tree, k):
+    position = 0
+    step = 1 << (len(tree) - 1).bit_length()
+    while step:
+        following = position + step
+        if following < len(tree) and tree[following] < k:
+            position = following
+            k -= tree[following]
+        step >>= 1
+    return position
+
+
+# Rolling statistics of the transactions over time: every step, a window of the given length ending at that
+# step, right-closed like pandas' rolling('30D') ((end - window, end]). Window and step take a name of
+# PERIODS or a timedelta, so e.g. window='quarter', step='week' gives weekly points of the last quarter.
+#
+# The rows are sorted by date once. The window's edges then only move forward: counts and sums come from
+# prefix sums as differences of two positions, and the median from a Fenwick tree of value ranks into which
+# only the rows entering or leaving the window are added or removed. Each row is touched twice in total, so
+# the cost is O((rows + windows) log rows) instead of re-aggregating every window.
+#
+# Returns a DataFrame indexed by window end with the number of priced rows, the mean and median of value
+# (NaN for windows without one) and the sum of volume. The volume is summed over the rows of volume_frame
+# when given (e.g. every transaction with a volume, priced or not, while frame holds only the priced ones),
+# over the windows of frame.
+def rolling_stats(frame, window='month', step='week', date='announcement_date', value='price_per_ton_EUR',
+                  volume='tons_purchased', start=None, end=None, volume_frame=None):
+    window, step = _timedelta(window), _timedelta(step)
+    frame = frame[frame[date].notna()].sort_values(date, kind='stable')
+    volume_frame = frame if volume_frame is None else \
+        volume_frame[volume_frame[date].notna()].sort_values(date, kind='stable')
+    dates = frame[date].to_numpy()
+    if not len(dates):
+        return pd.DataFrame(columns=['count', 'mean', 'median', 'volume'])
+
+    # Window ends: one step after another from the first full window to the last row (or start/end)
+    first = pd.Timestamp(start) if start is not None else pd.Timestamp(dates[0]).normalize() + window
+    last = max(first, pd.Timestamp(end) if end is not None else pd.Timestamp(dates[-1]))
+    ends = pd.date_range(first, last + step, freq=step)
+    ends = ends[:np.searchsorted(ends, last) + 1]
+    lefts = np.searchsorted(dates, (ends - window).to_numpy(), side='right')
+    rights = np.searchsorted(dates, ends.to_numpy(), side='right')
+
+    # Prefix sums over the sorted rows; missing values add nothing and are not counted
+    values = frame[value].to_numpy(dtype='float64')
+    priced = ~np.isnan(values)
+    counts = np.concatenate([[0], np.cumsum(priced)])
+    sums = np.concatenate([[0.0], np.cumsum(np.where(priced, values, 0.0))])
+    volumes = volume_frame[volume].to_numpy(dtype='float64')
+    volume_sums = np.concatenate([[0.0], np.cumsum(np.nan_to_num(volumes))])
+    volume_dates = volume_frame[date].to_numpy()
+    volume_lefts = np.searchsorted(volume_dates, (ends - window).to_numpy(), side='right')
+    volume_rights = np.searchsorted(volume_dates, ends.to_numpy(), side='right')
+    count = counts[rights] - counts[lefts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, (sums[rights] - sums[lefts]) / count, np.nan)
+
+    # Sliding median: ranks of the priced values among all of them (ties share one rank), then move the
+    # window edges forward, adding the rows that enter and removing the rows that leave
+    distinct, ranks = np.unique(values[priced], return_inverse=True)
+    row_rank = np.full(len(values), -1)
+    row_rank[priced] = ranks
+    tree = np.zeros(len(distinct) + 1, dtype='int64')
+    median = np.full(len(ends), np.nan)
+    low = high = 0
+    for i, (left, right) in enumerate(zip(lefts, rights)):
+        entering = row_rank[high:right]
+        _fenwick_add(tree, entering[entering >= 0], 1)
+        leaving = row_rank[low:left]
+        _fenwick_add(tree, leaving[leaving >= 0], -1)
+        low, high = left, right
+        n = count[i]
+        if n:
+            lower = distinct[_fenwick_kth(tree, (n + 1) // 2)]
+            upper = distinct[_fenwick_kth(tree, n // 2 + 1)]
+            median[i] = (lower + upper) / 2
+
+    return pd.DataFrame({
+        'count': count,
+        'mean': mean,
+        'median': median,
+        'volume': volume_sums[volume_rights] - volume_sums[volume_lefts],
+    }, index=pd.Index(ends, name='window_end'))